@@ -1,13 +1,52 @@
 #bigquery_io.py
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound, GoogleCloudError
 from classes.LoggingClass import LoggingManager
+from classes.ConfigManagerClass import ConfigManager
+from classes.GCS import GCSManager
+from schemas.bq_schemas import get_proto_row_class, df_to_proto_rows
 
 runtime_logger_level = 'DEBUG'
 
+# Incremental loads record, per target table, the newest source file they merged
+load_state_schema = [
+    bigquery.SchemaField("table_name", "STRING"),
+    bigquery.SchemaField("high_water_mark", "TIMESTAMP"),
+    bigquery.SchemaField("loaded_files", "INTEGER"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP")
+]
+
+# Updated time of every file staged by an incremental load, orders duplicate keys newest first
+source_files_schema = [
+    bigquery.SchemaField("uri", "STRING"),
+    bigquery.SchemaField("updated", "TIMESTAMP")
+]
+
+# Daily file format -> BigQuery load source format, arrow IPC files can't be loaded
+load_source_formats = {
+    'csv': bigquery.SourceFormat.CSV,
+    'parquet': bigquery.SourceFormat.PARQUET
+}
+
 class BigQueryManager():
+    # Storage Write API append requests are capped at 10MB, rows are batched below that
+    storage_write_max_request_bytes = 9 * 1024 * 1024
+    # BigQuery takes at most 10,000 source uris per load job / external table
+    max_uris_per_job = 10000
+
     def __init__(self):
         self.bq_client = bigquery.Client()
+        self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+        # Storage Write API client, created on first use (see write_df_to_bq_storage)
+        self.bq_write_client = None
+        # fully qualified name -> Table already fetched/created, saves a get_table round trip per load
+        self.known_tables = {}
+        self.known_tables_lock = threading.Lock()
         self.logging_manager = LoggingManager() 
 
         self.logger = self.logging_manager.create_logger(
@@ -17,6 +56,179 @@ class BigQueryManager():
             mode='a'
             )
 
+    @staticmethod
+    def _table_fullqual(table):
+        return f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+    def _get_or_create_table(self, table_ref, schema, partition_field=None, clustering_fields=None):
+        """
+        Returns the table at table_ref, creating it with schema if it doesn't exist.  With a
+        partition_field (a DATE/DATETIME/TIMESTAMP column) and/or clustering_fields a missing
+        table is created day partitioned and clustered.  An existing table is used as it is,
+        a different layout is only logged: migrating it rebuilds the table, so that is left
+        to migrate_table_layout (the bq_migrate_table_layouts entry point).
+        """
+        table_fullqual = self._table_fullqual(table_ref)
+        with self.known_tables_lock:
+            table = self.known_tables.get(table_fullqual)
+        if table is None:
+            try: # Check if the table already exists in BQ
+                table = self.bq_client.get_table(table_ref)
+                self.logger.info(f"{table_fullqual} already exists so a new one was not created.")
+                current_partition_field = table.time_partitioning.field if table.time_partitioning else None
+                if (partition_field or clustering_fields) and (
+                        current_partition_field != partition_field or (table.clustering_fields or None) != (clustering_fields or None)):
+                    self.logger.warning(
+                        f"{table_fullqual} is partitioned by {current_partition_field}, clustered by {table.clustering_fields} "
+                        f"instead of {partition_field}, {clustering_fields}; run bq_migrate_table_layouts to migrate it"
+                        )
+            except NotFound:
+                self.logger.warning(f"{table_fullqual} was not found. Creating new table.")
+                table = bigquery.Table(table_ref, schema=schema)
+                if partition_field:
+                    table.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field=partition_field)
+                if clustering_fields:
+                    table.clustering_fields = clustering_fields
+                table = self.bq_client.create_table(table)
+                self.logger.info(f"{table_fullqual} created.")
+
+        with self.known_tables_lock:
+            self.known_tables[table_fullqual] = table
+        return table
+
+    def migrate_table_layout(self, table, partition_field=None, clustering_fields=None):
+        """
+        Brings an existing table to the partitioning/clustering given, if it differs.
+
+        Clustering alone is updated in place (BigQuery reclusters data written from then on).
+        Partitioning can't be changed on a table, so it is rebuilt: the rows are copied into a
+        partitioned and clustered <table>__migrate, checked by row count, then the original
+        is dropped and the copy renamed in its place.  If the rename fails the rows are left
+        in <table>__migrate.
+        """
+        table_fullqual = self._table_fullqual(table)
+        current_partition_field = table.time_partitioning.field if table.time_partitioning else None
+        current_clustering_fields = table.clustering_fields or None
+        clustering_fields = clustering_fields or None
+
+        if current_partition_field == partition_field and current_clustering_fields == clustering_fields:
+            return table
+
+        if current_partition_field == partition_field:
+            self.logger.info(f"Clustering {table_fullqual} by {clustering_fields} (was {current_clustering_fields})")
+            table.clustering_fields = clustering_fields
+            return self.bq_client.update_table(table, ['clustering_fields'])
+
+        migrate_fullqual = f"{table_fullqual}__migrate"
+        partition_clause = f"PARTITION BY `{partition_field}`" if partition_field else ''
+        cluster_clause = f"CLUSTER BY {', '.join(f'`{field}`' for field in clustering_fields)}" if clustering_fields else ''
+        # DATETIME/TIMESTAMP columns are partitioned by their day
+        partition_field_type = {field.name: field.field_type for field in table.schema}.get(partition_field)
+        if partition_field_type == 'DATETIME':
+            partition_clause = f"PARTITION BY DATETIME_TRUNC(`{partition_field}`, DAY)"
+        elif partition_field_type == 'TIMESTAMP':
+            partition_clause = f"PARTITION BY TIMESTAMP_TRUNC(`{partition_field}`, DAY)"
+
+        self.logger.warning(f"Migrating {table_fullqual} from partitioning {current_partition_field} to {partition_field}, clustering {clustering_fields}")
+        migrate_script = f"""
+            CREATE OR REPLACE TABLE `{migrate_fullqual}` {partition_clause} {cluster_clause}
+            AS SELECT * FROM `{table_fullqual}`;
+            ASSERT (SELECT COUNT(*) FROM `{migrate_fullqual}`) = (SELECT COUNT(*) FROM `{table_fullqual}`)
+                AS 'Row count of the migrated copy does not match, {table_fullqual} was kept';
+            DROP TABLE `{table_fullqual}`;
+            ALTER TABLE `{migrate_fullqual}` RENAME TO `{table.table_id}`;
+        """
+        self.bq_client.query(migrate_script).result()
+        self.logger.info(f"Migrated {table_fullqual} to partitioning {partition_field}, clustering {clustering_fields}")
+        return self.bq_client.get_table(table.reference)
+
+    @staticmethod
+    def _job_summary(label, job):
+        """Returns the per job summary reported by wait_for_jobs"""
+        # QueryJob alone has a slot_millis property, every job type reports totalSlotMs in its REST
+        #  statistics.  Load/copy/query jobs build to_api_repr() for job insertion and leave the
+        #  statistics out of it (google-cloud-bigquery 3.x), so fall back to the fetched resource
+        statistics = job.to_api_repr().get('statistics') or job._properties.get('statistics', {})
+        summary = {
+            'label': label,
+            'job_id': job.job_id,
+            'job_type': job.job_type,
+            'state': job.state,
+            'error': job.error_result['message'] if job.error_result else None,
+            'bytes': getattr(job, 'input_file_bytes', None) or getattr(job, 'total_bytes_processed', None),
+            'rows': getattr(job, 'output_rows', None),
+            'slot_ms': int(statistics['totalSlotMs']) if statistics.get('totalSlotMs') else None,
+            'duration_seconds': (job.ended - job.started).total_seconds() if job.started and job.ended else None
+        }
+        return summary
+
+    @staticmethod
+    def _not_submitted_summary(label, error):
+        """Returns the job summary reported for a load that failed before its job was submitted"""
+        return {
+            'label': label, 'job_id': None, 'job_type': 'load', 'state': 'NOT_SUBMITTED',
+            'error': str(error), 'bytes': None, 'rows': None, 'slot_ms': None, 'duration_seconds': None
+        }
+
+    def wait_for_jobs(self, labelled_jobs, timeout_seconds=None):
+        """
+        Polls already submitted jobs together until every one is done, instead of blocking
+        on each job's result() in turn.  The poll interval starts at
+        config.bq_job_poll_initial_seconds and doubles up to config.bq_job_poll_max_seconds.
+
+        Args:
+            labelled_jobs (list): (label, job) pairs, eg. ('forecast staging parquet', load_job)
+            timeout_seconds (int): stop waiting after this long (default config.bq_job_timeout_seconds),
+                jobs still running are reported with their state
+
+        Returns:
+            list: a summary per job (see _job_summary): label, job_id, state, error, bytes,
+                rows, slot_ms and duration_seconds, in the order given
+        """
+        timeout_seconds = timeout_seconds or self.config.bq_job_timeout_seconds
+        deadline = time.monotonic() + timeout_seconds
+        poll_seconds = self.config.bq_job_poll_initial_seconds
+        pending_jobs = [job for _, job in labelled_jobs]
+        while pending_jobs and time.monotonic() < deadline:
+            # done() reloads the job state, one jobs.get request per pending job
+            pending_jobs = [job for job in pending_jobs if not job.done()]
+            if pending_jobs:
+                self.logger.debug(f"{len(pending_jobs)} of {len(labelled_jobs)} BigQuery jobs still running, polling again in {poll_seconds}s")
+                time.sleep(min(poll_seconds, max(0, deadline - time.monotonic())))
+                poll_seconds = min(poll_seconds * 2, self.config.bq_job_poll_max_seconds)
+
+        summaries = [self._job_summary(label, job) for label, job in labelled_jobs]
+        for summary in summaries:
+            self.logger.info(f"BigQuery job {summary['label']} ({summary['job_id']}): {summary['state']}, "
+                             f"{summary['bytes']} bytes, {summary['slot_ms']} slot ms, {summary['duration_seconds']}s"
+                             + (f", error: {summary['error']}" if summary['error'] else ''))
+        return summaries
+
+    @staticmethod
+    def _raise_for_failed_jobs(summaries):
+        failed = [summary for summary in summaries if summary['state'] != 'DONE' or summary['error']]
+        if failed:
+            raise GoogleCloudError('BigQuery jobs failed: ' + '; '.join(f"{summary['label']}: {summary['error'] or summary['state']}" for summary in failed))
+
+    def _submit_truncate_load(self, gcs_uri, table_ref, schema, partition_field=None, clustering_fields=None):
+        """
+        Submits a WRITE_TRUNCATE load of the csv at gcs_uri into table_ref (created if missing,
+        see _get_or_create_table) and returns the job without waiting on it
+        """
+        table = self._get_or_create_table(table_ref, schema, partition_field, clustering_fields)
+
+        # The table's partitioning and clustering are repeated so WRITE_TRUNCATE keeps them
+        job_config = bigquery.LoadJobConfig(
+            autodetect=False,
+            schema=schema,
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=1,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            time_partitioning=table.time_partitioning,
+            clustering_fields=table.clustering_fields
+        )
+        return self.bq_client.load_table_from_uri(gcs_uri, table.reference, job_config=job_config)
+
     def create_or_replace_bq_table_from_gcs(
             self,
             project_name, 
@@ -25,7 +237,9 @@ class BigQueryManager():
             source_file_name,
             target_dataset_name, 
             target_table_name,
-            schema
+            schema,
+            partition_field=None,
+            clustering_fields=None
             ):
         
         self.logger.debug('---------------------------------')
@@ -46,32 +260,453 @@ class BigQueryManager():
             self.logger.info(f"Source URI from GCS is: {gcs_uri}")
             self.logger.info(f"Target BQ table: {table_fullqual}")
 
-            try: # Check if the table already exists in BQ
-                self.bq_client.get_table(table_ref)
-                self.logger.info(f"{table_fullqual} already exists so a new one was not created. continuing with job load for {gcs_uri}.")
-            except NotFound:
-                self.logger.warning(f"{table_fullqual} was not found. Creating new table.")
-                table = bigquery.Table(table_ref, schema=schema)
-                self.bq_client.create_table(table)
-                self.logger.info(f"{table_fullqual} created, continuing with job load.")
-
-            # Configure the external data source and start the BigQuery Load job
-            job_config = bigquery.LoadJobConfig(
-                autodetect=False,
-                schema=schema,
-                source_format=bigquery.SourceFormat.CSV,
-                skip_leading_rows=1,
-                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE   
+            load_job = self._submit_truncate_load(gcs_uri, table_ref, schema, partition_field, clustering_fields)
+            job_summaries = self.wait_for_jobs([(target_table_name, load_job)])
+            self._raise_for_failed_jobs(job_summaries)
+
+            self.logger.info(f"This is the load_job_result: {load_job}")
+            return load_job
+
+        except GoogleCloudError as e:
+            self.logger.error(f"Google Cloud Error: {e}")
+            return None
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            return None
+
+    def refresh_tables_from_gcs(self, table_loads):
+        """
+        Concurrent version of create_or_replace_bq_table_from_gcs for several tables: every
+        WRITE_TRUNCATE load is submitted before waiting on any of them (see wait_for_jobs).
+
+        Args:
+            table_loads (list): dicts of create_or_replace_bq_table_from_gcs keyword arguments
+
+        Returns:
+            list: the job summary of each load, in the order of table_loads
+        """
+        labelled_jobs, failed_submissions = [], {}
+        for load_index, table_load in enumerate(table_loads):
+            table_fullqual = f"{table_load['project_name']}.{table_load['target_dataset_name']}.{table_load['target_table_name']}"
+            gcs_uri = f"gs://{table_load['source_bucket_name']}/{table_load['source_dir_path']}/{table_load['source_file_name']}"
+            try:
+                load_job = self._submit_truncate_load(
+                    gcs_uri, bigquery.TableReference.from_string(table_fullqual), table_load['schema'],
+                    table_load.get('partition_field'), table_load.get('clustering_fields')
+                    )
+                labelled_jobs.append((table_load['target_table_name'], load_job))
+                self.logger.info(f"Submitted load of {gcs_uri} into {table_fullqual}")
+            except GoogleCloudError as e:
+                self.logger.error(f"Google Cloud Error submitting the load of {table_fullqual}: {e}")
+                failed_submissions[load_index] = self._not_submitted_summary(table_load['target_table_name'], e)
+            except Exception as e:
+                self.logger.error(f"An error occurred submitting the load of {table_fullqual}: {e}")
+                failed_submissions[load_index] = self._not_submitted_summary(table_load['target_table_name'], e)
+
+        job_summaries = iter(self.wait_for_jobs(labelled_jobs))
+        return [failed_submissions[load_index] if load_index in failed_submissions else next(job_summaries) for load_index in range(len(table_loads))]
+
+    def _load_state_table_ref(self, project_name, dataset_name):
+        return bigquery.TableReference.from_string(f"{project_name}.{dataset_name}.{self.config.bq_load_state_table_name}")
+
+    def get_high_water_mark(self, project_name, dataset_name, table_name):
+        """
+        Returns the updated time of the newest source file merged into table_name by
+        incremental_load_bq_table_from_gcs, or None if it has never been loaded incrementally
+        """
+        state_table = self._get_or_create_table(self._load_state_table_ref(project_name, dataset_name), load_state_schema)
+        query = f"SELECT high_water_mark FROM `{self._table_fullqual(state_table)}` WHERE table_name = @table_name"
+        job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter('table_name', 'STRING', table_name)])
+        rows = list(self.bq_client.query(query, job_config=job_config).result())
+        return rows[0].high_water_mark if rows else None
+
+    def _group_source_uris(self, source_bucket_name, source_root_path, source_blobs, all_blob_names=None):
+        """
+        Groups source_blobs into one load per (format, hive partition keys): files under
+        root/key=value/ directories are loaded with hive partitioning so their partition
+        columns come back from the path, flat and compacted files carry every column.
+
+        With all_blob_names (every object under source_root_path) a group is collapsed to a
+        single wildcard uri, eg. gs://bucket/root/capture_date=*.parquet, when the wildcard
+        matches exactly the group's files.  Groups a wildcard would overreach (eg. sources a
+        compaction has replaced but not deleted yet) keep their explicit uris.
+        Returns {(file_format, partition_keys): [gcs uris]}
+        """
+        name_groups = {}
+        for blob in source_blobs:
+            file_format = GCSManager.get_file_format(blob.name)
+            if file_format not in load_source_formats:
+                raise ValueError(f"BigQuery can't load {blob.name}, daily files must be csv or parquet to be loaded directly")
+            partition_keys = tuple(GCSManager.parse_partition_values(blob.name[len(source_root_path):]))
+            name_groups.setdefault((file_format, partition_keys), []).append(blob.name)
+
+        uri_groups = {}
+        for group_key, names in name_groups.items():
+            wildcard_prefix = os.path.commonprefix(names)
+            wildcard_suffix = '.' + group_key[0]
+            group_names = set(names)
+            if all_blob_names is not None and len(names) > 1 and all(
+                    name in group_names for name in all_blob_names
+                    if name.startswith(wildcard_prefix) and name.endswith(wildcard_suffix)
+                    ):
+                uri_groups[group_key] = [f"gs://{source_bucket_name}/{wildcard_prefix}*{wildcard_suffix}"]
+            else:
+                uri_groups[group_key] = [f"gs://{source_bucket_name}/{name}" for name in names]
+        return uri_groups
+
+    def _chunk_uris(self, uris):
+        """Splits uris into lists of at most max_uris_per_job, the most a single job accepts"""
+        return [uris[start:start + self.max_uris_per_job] for start in range(0, len(uris), self.max_uris_per_job)]
+
+    def _stage_uri_groups_with_source_file(self, uri_groups, staging_ref, schema, source_uri_prefix, source_blobs, source_bucket_name, label=''):
+        """
+        Appends every group of uris to staging_ref (schema plus a _source_file column) by querying
+        them as temporary external tables, which unlike load jobs expose each row's _FILE_NAME.
+        The updated time of every source file goes to a <staging>_files table alongside, so a
+        key found in several files can be resolved to the newest one.  All jobs are submitted
+        together.  Returns (files table reference, job summaries)
+        """
+        columns = ', '.join(f"`{field.name}`" for field in schema)
+        labelled_jobs = []
+        for (file_format, partition_keys), uris in uri_groups.items():
+            for uris_chunk in self._chunk_uris(uris):
+                external_config = bigquery.ExternalConfig(load_source_formats[file_format])
+                external_config.source_uris = uris_chunk
+                external_config.schema = [field for field in schema if field.name not in partition_keys]
+                if file_format == 'csv':
+                    external_config.options.skip_leading_rows = 1
+                if partition_keys:
+                    external_config.hive_partitioning = self._hive_partitioning_options(schema, source_uri_prefix, partition_keys)
+                job_config = bigquery.QueryJobConfig(
+                    table_definitions={'daily_files': external_config},
+                    destination=staging_ref,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+                    )
+                query_job = self.bq_client.query(f"SELECT {columns}, _FILE_NAME AS _source_file FROM daily_files", job_config=job_config)
+                labelled_jobs.append((f"{label or staging_ref.table_id} stage {file_format}{' hive' if partition_keys else ''} ({len(uris_chunk)} uris)", query_job))
+
+        files_ref = bigquery.TableReference.from_string(f"{self._table_fullqual(staging_ref)}_files")
+        self._create_staging_table(files_ref, source_files_schema)
+        source_files = [{'uri': f"gs://{source_bucket_name}/{blob.name}", 'updated': blob.updated.isoformat()} for blob in source_blobs]
+        files_job = self.bq_client.load_table_from_json(
+            source_files, files_ref,
+            job_config=bigquery.LoadJobConfig(schema=source_files_schema, write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
             )
-            load_job = self.bq_client.load_table_from_uri(gcs_uri, table_ref, job_config=job_config)
-            load_job_result = load_job.result()
+        labelled_jobs.append((f"{label or staging_ref.table_id} stage source files", files_job))
+
+        summaries = self.wait_for_jobs(labelled_jobs)
+        self._raise_for_failed_jobs(summaries)
+        return files_ref, summaries
+
+    def _load_uri_groups(self, uri_groups, table_ref, schema, source_uri_prefix, label=''):
+        """
+        Appends every group of uris (see _group_source_uris) to table_ref, the load jobs are
+        submitted together and waited on with wait_for_jobs.  Returns (rows loaded, job summaries)
+        """
+        labelled_jobs = []
+        for (file_format, partition_keys), uris in uri_groups.items():
+            job_config = self._load_job_config(file_format, schema, bigquery.WriteDisposition.WRITE_APPEND, source_uri_prefix, partition_keys)
+            for uris_chunk in self._chunk_uris(uris):
+                load_job = self.bq_client.load_table_from_uri(uris_chunk, table_ref, job_config=job_config)
+                labelled_jobs.append((f"{label or table_ref.table_id} load {file_format}{' hive' if partition_keys else ''} ({len(uris_chunk)} uris)", load_job))
+
+        summaries = self.wait_for_jobs(labelled_jobs)
+        self._raise_for_failed_jobs(summaries)
+        return sum(summary['rows'] or 0 for summary in summaries), summaries
+
+    def _create_staging_table(self, staging_ref, schema, like_table=None):
+        # A fresh table (replacing whatever a failed run left behind) that expires on its own
+        #  if a run stops before dropping it
+        self.bq_client.delete_table(staging_ref, not_found_ok=True)
+        staging_table = bigquery.Table(staging_ref, schema=schema)
+        if like_table is not None:
+            staging_table.time_partitioning = like_table.time_partitioning
+            staging_table.clustering_fields = like_table.clustering_fields
+        staging_table.expires = datetime.now(timezone.utc) + timedelta(days=1)
+        return self.bq_client.create_table(staging_table)
 
-            self.logger.info(f"This is the load_job_result: {load_job_result}")
-            return load_job_result
+    def _load_job_config(self, file_format, schema, write_disposition, source_uri_prefix=None, partition_keys=()):
+        job_config = bigquery.LoadJobConfig(
+            autodetect=False,
+            # hive partition columns are added from the path, the files don't hold them
+            schema=[field for field in schema if field.name not in partition_keys],
+            source_format=load_source_formats[file_format],
+            write_disposition=write_disposition
+        )
+        if file_format == 'csv':
+            job_config.skip_leading_rows = 1
+        if partition_keys:
+            job_config.hive_partitioning = self._hive_partitioning_options(schema, source_uri_prefix, partition_keys)
+        return job_config
+
+    @staticmethod
+    def _hive_partitioning_options(schema, source_uri_prefix, partition_keys):
+        # eg. gs://bucket/root/{capture_date:DATE}, the partition columns are typed from schema
+        fields_by_name = {field.name: field for field in schema}
+        hive_options = bigquery.HivePartitioningOptions()
+        hive_options.mode = 'CUSTOM'
+        hive_options.source_uri_prefix = source_uri_prefix + ''.join(
+            f"/{{{key}:{fields_by_name[key].field_type if key in fields_by_name else 'STRING'}}}" for key in partition_keys
+            )
+        return hive_options
+
+    def incremental_load_bq_table_from_gcs(
+            self,
+            project_name,
+            source_bucket_name,
+            source_root_path,
+            source_blobs,
+            target_dataset_name,
+            target_table_name,
+            schema,
+            merge_key,
+            partition_field=None,
+            clustering_fields=None,
+            all_blob_names=None
+            ):
+        """
+        Loads only the daily files changed since the last incremental load instead of
+        truncating target_table_name with the whole unioned csv.
+
+        source_blobs (eg. GCSManager.iter_gcs_blobs under source_root_path) newer than the
+        table's high water mark (see get_high_water_mark) are staged with the file each row came
+        from (see _stage_uri_groups_with_source_file), then MERGEd into the target on merge_key
+        (eg. name, capture_date, forecast_datetime): matching rows are updated, new rows
+        inserted, and a key staged from several files takes the row of the newest file.
+        With all_blob_names the staged files are read through wildcard uris where possible
+        (see _group_source_uris).  The MERGE and the new high water mark are
+        committed in one transaction, so a retry after a failure reloads the same files and the
+        MERGE makes reloading them a no-op.  When the target is partitioned on a merge_key
+        column the MERGE only reads the partitions present in the staged rows.
+
+        Returns:
+            dict: files and staged rows loaded, the new high_water_mark and the job summaries
+                (see wait_for_jobs), None on error
+        """
+        table_fullqual = f"{project_name}.{target_dataset_name}.{target_table_name}"
+        staging_fullqual = f"{table_fullqual}{self.config.bq_staging_table_suffix}"
+        state_table_ref = self._load_state_table_ref(project_name, target_dataset_name)
+        state_fullqual = self._table_fullqual(state_table_ref)
+
+        try:
+            self._get_or_create_table(bigquery.TableReference.from_string(table_fullqual), schema, partition_field, clustering_fields)
+            high_water_mark = self.get_high_water_mark(project_name, target_dataset_name, target_table_name)
+            new_blobs = [blob for blob in source_blobs if high_water_mark is None or blob.updated > high_water_mark]
+            if not new_blobs:
+                self.logger.info(f"{table_fullqual} is up to date (high water mark {high_water_mark})")
+                return {'files': 0, 'rows': 0, 'high_water_mark': high_water_mark, 'jobs': []}
+
+            # Stage the new files in a table with the full schema, so every group appends to it by column name
+            staging_ref = bigquery.TableReference.from_string(staging_fullqual)
+            self._create_staging_table(staging_ref, schema + [bigquery.SchemaField('_source_file', 'STRING')])
+            source_uri_prefix = f"gs://{source_bucket_name}/{source_root_path.rstrip('/')}"
+            uri_groups = self._group_source_uris(source_bucket_name, source_root_path, new_blobs, all_blob_names)
+            files_ref, job_summaries = self._stage_uri_groups_with_source_file(
+                uri_groups, staging_ref, schema, source_uri_prefix, new_blobs, source_bucket_name, label=target_table_name
+                )
+            files_fullqual = self._table_fullqual(files_ref)
+            staged_rows = self.bq_client.get_table(staging_ref).num_rows
+
+            columns = [field.name for field in schema]
+            key_condition = ' AND '.join(f"target.`{key}` IS NOT DISTINCT FROM source.`{key}`" for key in merge_key)
+            update_columns = ', '.join(f"`{column}` = source.`{column}`" for column in columns if column not in merge_key)
+            insert_columns = ', '.join(f"`{column}`" for column in columns)
+            partition_by = ', '.join(f"staged.`{key}`" for key in merge_key)
+            staged_columns = ', '.join(f"staged.`{column}`" for column in columns)
+            # Bounding the partition column by the staged range (script variables are constants
+            #  to the MERGE) prunes the target scan to the partitions being written
+            partition_bounds = ''
+            partition_filter = ''
+            if partition_field and partition_field in merge_key:
+                partition_bounds = f"""
+                DECLARE min_partition_value DEFAULT (SELECT MIN(`{partition_field}`) FROM `{staging_fullqual}`);
+                DECLARE max_partition_value DEFAULT (SELECT MAX(`{partition_field}`) FROM `{staging_fullqual}`);"""
+                partition_filter = f" AND (target.`{partition_field}` BETWEEN min_partition_value AND max_partition_value OR target.`{partition_field}` IS NULL)"
+            # A key repeated across the staged files would make the MERGE fail, keep the row from
+            #  the most recently updated file (file name breaks ties, so reruns pick the same row)
+            merge_script = f"""{partition_bounds}
+                BEGIN TRANSACTION;
+                MERGE `{table_fullqual}` AS target
+                USING (
+                    SELECT * EXCEPT(_row_number) FROM (
+                        SELECT {staged_columns}, ROW_NUMBER() OVER (
+                            PARTITION BY {partition_by} ORDER BY files.updated DESC, staged._source_file DESC
+                            ) AS _row_number
+                        FROM `{staging_fullqual}` AS staged
+                        LEFT JOIN `{files_fullqual}` AS files ON files.uri = staged._source_file
+                    ) WHERE _row_number = 1
+                ) AS source
+                ON {key_condition}{partition_filter}
+                WHEN MATCHED THEN UPDATE SET {update_columns}
+                WHEN NOT MATCHED THEN INSERT ({insert_columns}) VALUES ({insert_columns});
+                MERGE `{state_fullqual}` AS state
+                USING (SELECT @table_name AS table_name, @high_water_mark AS high_water_mark, @loaded_files AS loaded_files) AS loaded
+                ON state.table_name = loaded.table_name
+                WHEN MATCHED THEN UPDATE SET high_water_mark = loaded.high_water_mark, loaded_files = loaded.loaded_files, updated_at = CURRENT_TIMESTAMP()
+                WHEN NOT MATCHED THEN INSERT (table_name, high_water_mark, loaded_files, updated_at)
+                    VALUES (loaded.table_name, loaded.high_water_mark, loaded.loaded_files, CURRENT_TIMESTAMP());
+                COMMIT TRANSACTION;
+                DROP TABLE IF EXISTS `{staging_fullqual}`;
+                DROP TABLE IF EXISTS `{files_fullqual}`;
+            """
+            new_high_water_mark = max(blob.updated for blob in new_blobs)
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter('table_name', 'STRING', target_table_name),
+                bigquery.ScalarQueryParameter('high_water_mark', 'TIMESTAMP', new_high_water_mark),
+                bigquery.ScalarQueryParameter('loaded_files', 'INT64', len(new_blobs))
+            ])
+            merge_job = self.bq_client.query(merge_script, job_config=job_config)
+            merge_summaries = self.wait_for_jobs([(f"{target_table_name} merge", merge_job)])
+            self._raise_for_failed_jobs(merge_summaries)
+            job_summaries += merge_summaries
+
+            self.logger.info(f"Merged {staged_rows} rows from {len(new_blobs)} files into {table_fullqual}, high water mark {new_high_water_mark}")
+            return {'files': len(new_blobs), 'rows': staged_rows, 'high_water_mark': new_high_water_mark, 'jobs': job_summaries}
+
+        except GoogleCloudError as e:
+            self.logger.error(f"Google Cloud Error: {e}")
+            return None
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            return None
+
+    def load_bq_table_from_daily_files(
+            self,
+            project_name,
+            source_bucket_name,
+            source_root_path,
+            source_blobs,
+            target_dataset_name,
+            target_table_name,
+            schema,
+            all_blob_names=None,
+            partition_field=None,
+            clustering_fields=None
+            ):
+        """
+        Replaces target_table_name with the daily files themselves (bq_load_source
+        'daily_files'), so the GCS union doesn't have to run before the load and BigQuery
+        reads the files in parallel.
+
+        source_blobs (the daily and compacted files under source_root_path, already filtered
+        of compacted sources) are grouped into wildcard/hive partitioned uris (see
+        _group_source_uris) and loaded into a staging table laid out like the target, which
+        is then copied over the target with WRITE_TRUNCATE in a single job: queries see either
+        the old or the new table, never a partial load.
+
+        Returns:
+            dict: files, rows and the uris loaded and the job summaries (see wait_for_jobs),
+                None on error
+        """
+        table_fullqual = f"{project_name}.{target_dataset_name}.{target_table_name}"
+        staging_ref = bigquery.TableReference.from_string(f"{table_fullqual}{self.config.bq_staging_table_suffix}")
+
+        try:
+            source_blobs = list(source_blobs)
+            if not source_blobs:
+                self.logger.warning(f"No daily files under gs://{source_bucket_name}/{source_root_path}, {table_fullqual} left as is")
+                return {'files': 0, 'rows': 0, 'uris': [], 'jobs': []}
+
+            table = self._get_or_create_table(bigquery.TableReference.from_string(table_fullqual), schema, partition_field, clustering_fields)
+            self._create_staging_table(staging_ref, schema, like_table=table)
+            source_uri_prefix = f"gs://{source_bucket_name}/{source_root_path.rstrip('/')}"
+            uri_groups = self._group_source_uris(source_bucket_name, source_root_path, source_blobs, all_blob_names)
+            loaded_rows, job_summaries = self._load_uri_groups(uri_groups, staging_ref, schema, source_uri_prefix, label=target_table_name)
+
+            copy_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+            copy_job = self.bq_client.copy_table(staging_ref, table.reference, job_config=copy_config)
+            copy_summaries = self.wait_for_jobs([(f"{target_table_name} swap", copy_job)])
+            self._raise_for_failed_jobs(copy_summaries)
+            job_summaries += copy_summaries
+            self.bq_client.delete_table(staging_ref, not_found_ok=True)
+
+            uris = [uri for group_uris in uri_groups.values() for uri in group_uris]
+            self.logger.info(f"Replaced {table_fullqual} with {loaded_rows} rows from {len(source_blobs)} daily files ({len(uris)} uris)")
+            return {'files': len(source_blobs), 'rows': loaded_rows, 'uris': uris, 'jobs': job_summaries}
 
         except GoogleCloudError as e:
             self.logger.error(f"Google Cloud Error: {e}")
             return None
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def write_df_to_bq_storage(self, df, project_name, dataset_name, table_name, schema, partition_field=None, clustering_fields=None):
+        """
+        Appends df to table_name through the BigQuery Storage Write API, so the rows are
+        queryable seconds after the run instead of after the union and load jobs.
+
+        Rows are typed from schema (see schemas.bq_schemas.get_proto_row_class) and sent as
+        protobuf batches on a PENDING write stream.  Every append carries the offset of its
+        first row, so an append retried after a dropped connection can't be written twice,
+        and the rows only become visible when the stream is committed: all of df or nothing.
+        Needs the optional google-cloud-bigquery-storage package.
+
+        Returns:
+            dict: rows and append requests written, None on error
+        """
+        table_fullqual = f"{project_name}.{dataset_name}.{table_name}"
+        try:
+            from google.cloud import bigquery_storage_v1
+            from google.cloud.bigquery_storage_v1 import types, writer
+            from google.protobuf import descriptor_pb2
+        except ImportError:
+            self.logger.error("google-cloud-bigquery-storage is not installed, can't write to BigQuery through the Storage Write API")
+            return None
+
+        try:
+            self._get_or_create_table(bigquery.TableReference.from_string(table_fullqual), schema, partition_field, clustering_fields)
+            if self.bq_write_client is None:
+                self.bq_write_client = bigquery_storage_v1.BigQueryWriteClient()
+
+            row_class = get_proto_row_class(schema)
+            serialized_rows = df_to_proto_rows(df, schema, row_class)
+
+            parent = self.bq_write_client.table_path(project_name, dataset_name, table_name)
+            write_stream = types.WriteStream(type_=types.WriteStream.Type.PENDING)
+            write_stream = self.bq_write_client.create_write_stream(parent=parent, write_stream=write_stream)
+
+            # The writer schema is sent once, with the first request on the connection
+            proto_descriptor = descriptor_pb2.DescriptorProto()
+            row_class.DESCRIPTOR.CopyToProto(proto_descriptor)
+            request_template = types.AppendRowsRequest(
+                write_stream=write_stream.name,
+                proto_rows=types.AppendRowsRequest.ProtoData(writer_schema=types.ProtoSchema(proto_descriptor=proto_descriptor))
+                )
+            append_rows_stream = writer.AppendRowsStream(self.bq_write_client, request_template)
+
+            append_futures = []
+            batch, batch_bytes, offset = [], 0, 0
+            for row_index, serialized_row in enumerate(serialized_rows + [None]):
+                is_last = serialized_row is None
+                if batch and (is_last or batch_bytes + len(serialized_row) > self.storage_write_max_request_bytes):
+                    request = types.AppendRowsRequest(
+                        offset=offset,
+                        proto_rows=types.AppendRowsRequest.ProtoData(rows=types.ProtoRows(serialized_rows=batch))
+                        )
+                    append_futures.append(append_rows_stream.send(request))
+                    offset = row_index
+                    batch, batch_bytes = [], 0
+                if not is_last:
+                    batch.append(serialized_row)
+                    batch_bytes += len(serialized_row)
+            for append_future in append_futures:
+                append_future.result()
+            append_rows_stream.close()
+
+            self.bq_write_client.finalize_write_stream(name=write_stream.name)
+            commit_response = self.bq_write_client.batch_commit_write_streams(
+                types.BatchCommitWriteStreamsRequest(parent=parent, write_streams=[write_stream.name])
+                )
+            if commit_response.stream_errors:
+                raise GoogleCloudError(f"Commit of {write_stream.name} failed: {list(commit_response.stream_errors)}")
+
+            self.logger.info(f"Wrote {len(serialized_rows)} rows to {table_fullqual} in {len(append_futures)} Storage Write API appends")
+            return {'rows': len(serialized_rows), 'appends': len(append_futures)}
+
+        except GoogleCloudError as e:
+            self.logger.error(f"Google Cloud Error: {e}")
+            return None
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            return None
@@ -0,0 +1,209 @@
+import json
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from classes.LoggingClass import LoggingManager
+from classes.ConfigManagerClass import ConfigManager
+from classes.GCS import GCSManager
+
+runtime_logger_level = 'INFO'
+
+class CompactionManager:
+    """
+    Merges the daily files of a closed month into a single sorted parquet file.
+
+    Each dataset root (eg. config.wthr_forecast_csvpath) gets a root/compacted/ folder with
+    one <root name>_YYYY-MM.parquet per month and a _manifest.json recording, per month, the
+    compacted file (generation, crc32c, row count) and the source files it replaced.  The
+    manifest is the commit point: sources are only deleted (or archived) after it has been
+    swapped in, and readers use filter_compacted_sources to skip sources that a compaction
+    has replaced but not yet deleted.
+    """
+    compacted_folder_name = 'compacted'
+    manifest_file_name = '_manifest.json'
+
+    def __init__(self, gcs_manager=None):
+        self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+        self.logging_manager = LoggingManager()
+        self.logger = self.logging_manager.create_logger(
+            logger_name='log_CompactionManager',
+            debug_level=runtime_logger_level,
+            stream_logs=True,
+            mode='a'
+        )
+        self.gcs_manager = gcs_manager or GCSManager()
+
+    def _compacted_folder(self, root_path):
+        return f"{root_path.rstrip('/')}/{self.compacted_folder_name}"
+
+    def _compacted_filepath(self, root_path, month):
+        root_name = root_path.rstrip('/').split('/')[-1]
+        return f"{self._compacted_folder(root_path)}/{root_name}_{month}.parquet"
+
+    def read_manifest(self, bucket_name, root_path):
+        """Returns (manifest, generation) for root_path, ({'months': {}}, 0) if there is none yet"""
+        manifest_filepath = f"{self._compacted_folder(root_path)}/{self.manifest_file_name}"
+        manifest_blob = self.gcs_manager.storage.stat(bucket_name, manifest_filepath)
+        if manifest_blob is None:
+            return {'months': {}}, 0
+        manifest_bytes = self.gcs_manager.storage.read_bytes(bucket_name, manifest_filepath, if_generation_match=manifest_blob.generation)
+        return json.loads(manifest_bytes), manifest_blob.generation
+
+    def _swap_manifest(self, bucket_name, root_path, manifest, expected_generation):
+        # A single object write is atomic, and conditioning it on the generation that was read
+        #  makes a concurrent compaction of the same root fail instead of losing its update
+        manifest['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.gcs_manager.storage.write_bytes(
+            bucket_name, f"{self._compacted_folder(root_path)}/{self.manifest_file_name}",
+            json.dumps(manifest, indent=2),
+            content_type='application/json',
+            if_generation_match=expected_generation
+            )
+
+    def filter_compacted_sources(self, bucket_name, root_path, blobs):
+        """
+        Yields the blobs that aren't a source already merged into a compacted month (same name
+        and generation), or compaction bookkeeping.  Keeps the unions from counting rows twice
+        if a compaction stopped between its manifest swap and deleting the sources.
+        """
+        manifest, _ = self.read_manifest(bucket_name, root_path)
+        compacted_sources = {
+            (source['name'], source['generation'])
+            for month_entry in manifest['months'].values()
+            for source in month_entry['sources']
+            }
+        for blob in blobs:
+            if blob.name.endswith(self.manifest_file_name):
+                continue
+            if (blob.name, blob.generation) in compacted_sources:
+                continue
+            yield blob
+
+    def is_month_closed(self, month):
+        """A month is closed once its last day is more than config.compaction_grace_days ago"""
+        month_start = datetime.strptime(month, '%Y-%m').date()
+        next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+        return (date.today() - next_month_start).days >= self.config.compaction_grace_days
+
+    def list_closed_month_sources(self, bucket_name, root_path):
+        """Returns {'YYYY-MM': [blobs]} of the daily files under root_path in closed months"""
+        compacted_folder = self._compacted_folder(root_path) + '/'
+        sources_by_month = {}
+        for blob in self.gcs_manager.iter_gcs_blobs(bucket_name, prefix=root_path):
+            if blob.name.startswith(compacted_folder) or self.gcs_manager.get_file_format(blob.name) is None:
+                continue
+            blob_date = self.gcs_manager.parse_blob_date(blob.name)
+            if blob_date is None:
+                continue
+            month = blob_date.strftime('%Y-%m')
+            if self.is_month_closed(month):
+                sources_by_month.setdefault(month, []).append(blob)
+        return sources_by_month
+
+    @staticmethod
+    def _content_checksum(df):
+        # Order independent, so the sorted output can be checked against the unsorted sources
+        return int(pd.util.hash_pandas_object(df, index=False).sum()) & 0xFFFFFFFFFFFFFFFF
+
+    def _delete_or_archive(self, bucket_name, sources):
+        """Deletes (or copies to config.compaction_archive_prefix, then deletes) sources in bulk"""
+        storage_backend = self.gcs_manager.storage
+        archive_prefix = self.config.compaction_archive_prefix
+        if archive_prefix:
+            with ThreadPoolExecutor(max_workers=self.config.gcs_union_max_workers) as executor:
+                list(executor.map(
+                    lambda source: storage_backend.copy(
+                        bucket_name, source['name'], f"{archive_prefix.rstrip('/')}/{source['name']}",
+                        if_source_generation_match=source['generation']
+                        ),
+                    sources
+                    ))
+        # Deletes are conditional on the compacted generation, a source rewritten since is kept
+        storage_backend.delete_many(bucket_name, [(source['name'], source['generation']) for source in sources])
+
+    def compact_month(self, bucket_name, root_path, month, source_blobs, schema, sort_columns):
+        """
+        Merges source_blobs (the daily files of month) and any existing compacted file for the
+        month into root/compacted/<root name>_<month>.parquet sorted by sort_columns, checks the
+        written file against the sources, swaps the manifest and removes the sources.
+
+        Returns:
+            dict: month, sources, rows and the compacted file path
+
+        Raises:
+            ValueError: if the compacted file doesn't match its sources, nothing is removed
+        """
+        compacted_filepath = self._compacted_filepath(root_path, month)
+        manifest, manifest_generation = self.read_manifest(bucket_name, root_path)
+
+        # Sources left behind by a compaction that stopped after its manifest swap only need deleting
+        already_compacted = {(source['name'], source['generation']) for source in manifest['months'].get(month, {}).get('sources', [])}
+        leftover_sources = [{'name': blob.name, 'generation': blob.generation} for blob in source_blobs if (blob.name, blob.generation) in already_compacted]
+        source_blobs = [blob for blob in source_blobs if (blob.name, blob.generation) not in already_compacted]
+        if leftover_sources:
+            self.logger.info(f"Removing {len(leftover_sources)} sources already compacted into {compacted_filepath}")
+            self._delete_or_archive(bucket_name, leftover_sources)
+        if not source_blobs:
+            return {'month': month, 'sources': 0, 'rows': manifest['months'].get(month, {}).get('row_count', 0), 'compacted_filepath': compacted_filepath}
+
+        # Late files for an already compacted month are merged with the existing compacted file
+        dfs = self.gcs_manager._read_blobs(source_blobs, schema=schema)
+        month_entry = manifest['months'].get(month)
+        if month_entry:
+            compacted_blob = self.gcs_manager.storage.stat(bucket_name, compacted_filepath)
+            if compacted_blob is None or compacted_blob.generation != month_entry['generation']:
+                raise ValueError(f"{compacted_filepath} is missing or was rewritten outside the compaction manifest")
+            dfs.append(self.gcs_manager._read_blob_to_df(compacted_blob, schema))
+
+        month_df = pd.concat(dfs, ignore_index=True)
+        month_df = month_df.sort_values([column for column in sort_columns if column in month_df.columns], kind='stable', ignore_index=True)
+        expected_checksum = self._content_checksum(month_df)
+
+        self.gcs_manager.write_df_to_gcs(
+            df=month_df,
+            bucket_name=bucket_name,
+            gcs_bucket_filepath=compacted_filepath,
+            file_format='parquet',
+            schema=schema,
+            skip_unchanged=False
+            )
+
+        # Read the compacted file back and check it holds exactly the source rows
+        compacted_blob = self.gcs_manager.storage.stat(bucket_name, compacted_filepath)
+        compacted_df = self.gcs_manager._read_blob_to_df(compacted_blob, schema)
+        if len(compacted_df) != len(month_df) or self._content_checksum(compacted_df) != expected_checksum:
+            raise ValueError(f"{compacted_filepath} doesn't match its {len(source_blobs)} sources "
+                             f"({len(compacted_df)} rows written, {len(month_df)} expected), sources kept")
+
+        sources = (month_entry['sources'] if month_entry else []) + [
+            {'name': blob.name, 'generation': blob.generation, 'crc32c': blob.crc32c} for blob in source_blobs
+            ]
+        manifest['months'][month] = {
+            'filepath': compacted_filepath,
+            'generation': compacted_blob.generation,
+            'crc32c': compacted_blob.crc32c,
+            'row_count': len(compacted_df),
+            'content_checksum': expected_checksum,
+            'sources': sources
+            }
+        self._swap_manifest(bucket_name, root_path, manifest, manifest_generation)
+
+        new_sources = [{'name': blob.name, 'generation': blob.generation} for blob in source_blobs]
+        self._delete_or_archive(bucket_name, new_sources)
+        self.logger.info(f"Compacted {len(source_blobs)} files ({len(compacted_df)} rows) into {compacted_filepath}")
+        return {'month': month, 'sources': len(source_blobs), 'rows': len(compacted_df), 'compacted_filepath': compacted_filepath}
+
+    def compact_closed_months(self, bucket_name, root_path, schema, sort_columns):
+        """Compacts every closed month under root_path that still has daily files, oldest first"""
+        sources_by_month = self.list_closed_month_sources(bucket_name, root_path)
+        results = []
+        for month in sorted(sources_by_month):
+            results.append(self.compact_month(bucket_name, root_path, month, sources_by_month[month], schema, sort_columns))
+        return results
+
+if __name__ == '__main__':
+    config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+    compaction_manager = CompactionManager()
+    print(compaction_manager.list_closed_month_sources(config.bucket_name, config.wthr_forecast_csvpath).keys())
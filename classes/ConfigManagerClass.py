@@ -65,14 +65,97 @@ class ConfigManager:
             self.log_responses_directory = yaml_config.get('log_responses_directory', '/log/responses')
             self.primary_gcs_download_folder = yaml_config.get('primary_gcs_download_folder')
 
+        # Forecast response cache (classes/ResponseCache.py), fresh entries skip the API request
+        #  and stale entries are served if the request fails
+        self.forecast_cache_enabled = yaml_config.get('forecast_cache_enabled', True)
+        self.forecast_cache_directory = yaml_config.get('forecast_cache_directory', os.path.join(self.log_responses_directory, 'cache'))
+        self.forecast_cache_ttl_seconds = yaml_config.get('forecast_cache_ttl_seconds', 3*60*60)
+        self.forecast_cache_max_entries = yaml_config.get('forecast_cache_max_entries', 500)
+
         self.gcp_project_name = yaml_config.get('gcp_project_name')
 
         self.bq_dataset_name = yaml_config.get('bq_dataset_name')
         self.bq_historic_table_name=yaml_config.get('bq_historic_table_name')
         self.bq_forecast_table_name=yaml_config.get('bq_forecast_table_name')
+        # How the bq_* entry points load: 'truncate' reloads the unioned csv with WRITE_TRUNCATE,
+        #  'incremental' (opt in) MERGEs only the daily files changed since the last load (high
+        #  water marks kept in bq_load_state_table_name)
+        self.bq_load_mode = yaml_config.get('bq_load_mode', 'truncate')
+        # bq_load_mode 'truncate' reads the 'unioned' csv or, with 'daily_files', the daily and
+        #  compacted files directly through wildcard/hive partitioned uris (no union needed first)
+        self.bq_load_source = yaml_config.get('bq_load_source', 'unioned')
+        # Also write each forecast run straight to bq_forecast_table_name through the Storage Write
+        #  API (needs google-cloud-bigquery-storage), GCS is still written for archival
+        self.bq_storage_write_forecasts = yaml_config.get('bq_storage_write_forecasts', False)
+        # BigQueryManager.wait_for_jobs polls submitted jobs together, backing off from the initial
+        #  to the max interval, and stops waiting after bq_job_timeout_seconds
+        self.bq_job_poll_initial_seconds = yaml_config.get('bq_job_poll_initial_seconds', 1)
+        self.bq_job_poll_max_seconds = yaml_config.get('bq_job_poll_max_seconds', 30)
+        self.bq_job_timeout_seconds = yaml_config.get('bq_job_timeout_seconds', 3600)
+        self.bq_load_state_table_name = yaml_config.get('bq_load_state_table_name', '_load_state')
+        self.bq_staging_table_suffix = yaml_config.get('bq_staging_table_suffix', '__staging')
+        self.bq_forecast_merge_key = yaml_config.get('bq_forecast_merge_key', ['name', 'capture_date', 'forecast_datetime'])
+        self.bq_historic_merge_key = yaml_config.get('bq_historic_merge_key', ['name', 'weather_date', 'forecast_datetime'])
+        # Missing tables are created day partitioned on these columns and clustered on these
+        #  fields, existing tables only change when bq_migrate_table_layouts is run.  None/[]
+        #  leaves a table unpartitioned/unclustered
+        self.bq_forecast_partition_field = yaml_config.get('bq_forecast_partition_field', 'capture_date')
+        self.bq_historic_partition_field = yaml_config.get('bq_historic_partition_field', 'weather_date')
+        self.bq_forecast_clustering_fields = yaml_config.get('bq_forecast_clustering_fields', ['name', 'forecast_datetime'])
+        self.bq_historic_clustering_fields = yaml_config.get('bq_historic_clustering_fields', ['name', 'forecast_datetime'])
 
         self.pubsub_project_id = yaml_config.get('pubsub_project_id') 
         self.bucket_name = yaml_config.get('bucket_name')
+        self.gcs_list_page_size = yaml_config.get('gcs_list_page_size', 1000)
+        self.gcs_verify_bucket_exists = yaml_config.get('gcs_verify_bucket_exists', False)
+        self.gcs_union_max_workers = yaml_config.get('gcs_union_max_workers', 8)
+
+        # Where GCSManager reads and writes objects (classes/StorageBackend.py): 'gcs', 'local'
+        #  (files under storage_local_directory/<bucket_name>/) or 'memory' (tests, benchmarks)
+        self.storage_backend = yaml_config.get('storage_backend', 'gcs')
+        self.storage_local_directory = yaml_config.get('storage_local_directory', 'local_storage')
+        # Parallel downloads when mirroring a folder locally (download_all_files_in_gcs_folder)
+        self.gcs_sync_max_workers = yaml_config.get('gcs_sync_max_workers', 8)
+
+        # How the unioned forecast/historic files are built: 'incremental' appends only daily
+        #  files missing from the union manifest, 'full' re-reads every daily file, 'stream' is
+        #  'full' with bounded memory, 'compose' concatenates headerless csv parts written next to
+        #  the unioned file server side
+        self.union_mode = yaml_config.get('union_mode', 'incremental')
+        # union_mode 'stream' reads and writes the union chunk by chunk within this many MB
+        self.union_stream_max_memory_mb = yaml_config.get('union_stream_max_memory_mb', 256)
+        self.union_stream_read_buffer_mb = yaml_config.get('union_stream_read_buffer_mb', 4)
+
+        # Format of the daily forecast/historic files: 'parquet', 'arrow' or 'csv'.  Unioned
+        #  outputs stay csv for the BigQuery loads
+        self.daily_file_format = yaml_config.get('daily_file_format', 'parquet')
+        self.parquet_compression = yaml_config.get('parquet_compression', 'snappy')
+
+        # Layout of the daily files: 'partitioned' writes hive style <root>/capture_date=YYYY-MM-DD/part-00000.<ext>
+        #  (weather_date= for historic), 'flat' writes one '<name>_YYYY-MM-DD.<ext>' file per day.
+        #  storage_partition_by_user adds a name=<user> level below the date
+        self.storage_layout = yaml_config.get('storage_layout', 'partitioned')
+        self.storage_partition_by_user = yaml_config.get('storage_partition_by_user', False)
+
+        # Monthly compaction (classes/CompactionManager.py): a month is compacted once its last day
+        #  is compaction_grace_days old (historic weather lags 6 days).  Sources are deleted, or
+        #  copied under compaction_archive_prefix first when it is set
+        self.compaction_grace_days = yaml_config.get('compaction_grace_days', 7)
+        self.compaction_archive_prefix = yaml_config.get('compaction_archive_prefix')
+
+        # Uploads: csv objects are gzipped (Content-Encoding: gzip), dfs with at least
+        #  gcs_stream_upload_min_rows rows are streamed into a resumable upload in chunks of
+        #  gcs_upload_chunk_rows rows / gcs_upload_chunk_size_mb (a multiple of 256KB)
+        self.gcs_upload_gzip = yaml_config.get('gcs_upload_gzip', True)
+        self.gcs_stream_upload_min_rows = yaml_config.get('gcs_stream_upload_min_rows', 50000)
+        self.gcs_upload_chunk_rows = yaml_config.get('gcs_upload_chunk_rows', 50000)
+        self.gcs_upload_chunk_size_mb = yaml_config.get('gcs_upload_chunk_size_mb', 8)
+
+        # Skip uploads whose CRC32C/MD5 match the existing object, writes are conditional on the
+        #  object generation so concurrent writers can't clobber each other.  Costs a stat and a
+        #  serialized payload per write, so it is off by default and enabled per call
+        #  (write_df_to_gcs(skip_unchanged=True)) for small, often unchanged outputs
+        self.gcs_skip_unchanged_uploads = yaml_config.get('gcs_skip_unchanged_uploads', False)
         self.gcs_credential_filepath = yaml_config.get('gcs_credential_filepath')
 
         self.response_file_name = yaml_config.get('response_file_name', 'response')
@@ -93,6 +176,27 @@ class ConfigManager:
         #Users details: dict data type
         self.users_details = yaml_config.get('users_details', [])
 
+        # Forecast fetching: 'concurrent' runs each users request on a bounded thread pool,
+        #  'sequential' runs them one after another
+        self.forecast_fetch_mode = yaml_config.get('forecast_fetch_mode', 'concurrent')
+        self.forecast_fetch_max_workers = yaml_config.get('forecast_fetch_max_workers', 8)
+
+        # Users within the same grid cell (in degrees, 0.05 is roughly 5km) share a single forecast
+        #  request, set to 0 to request a forecast per user
+        self.forecast_geo_grid_degrees = yaml_config.get('forecast_geo_grid_degrees', 0.05)
+
+        # Historic weather: number of locations sent in each Open-Meteo archive request
+        self.openmeteo_batch_size = yaml_config.get('openmeteo_batch_size', 50)
+
+        # Shared HTTP session (classes/HttpSessionManager.py), pool_maxsize should be at
+        #  least forecast_fetch_max_workers so concurrent fetches don't discard connections
+        self.http_pool_connections = yaml_config.get('http_pool_connections', 4)
+        self.http_pool_maxsize = yaml_config.get('http_pool_maxsize', 16)
+        self.http_retries = yaml_config.get('http_retries', 3)
+        self.http_backoff_factor = yaml_config.get('http_backoff_factor', 0.5)
+        self.http_connect_timeout_seconds = yaml_config.get('http_connect_timeout_seconds', 5)
+        self.http_read_timeout_seconds = yaml_config.get('http_read_timeout_seconds', 30)
+
         # GCS
         self.forecast_unioned_csvpath = yaml_config.get('forecast_unioned_csvpath')
 
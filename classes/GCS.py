@@ -1,17 +1,87 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
 import os
+import gzip
+import json
+import base64
+import hashlib
+import tempfile
+import re
+import fnmatch
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import quote, unquote
 
+import google_crc32c
 from google.cloud import bigquery
-from google.cloud import storage
 from google.cloud.exceptions import NotFound
 
 from classes.LoggingClass import LoggingManager
 from classes.ConfigManagerClass import ConfigManager
+from classes.StorageBackend import get_storage_backend, max_compose_sources
+from schemas.bq_schemas import coerce_df_to_schema, get_arrow_schema
 
 runtime_logger_level = 'INFO'
 
+# Daily files carry their date in the name, eg. '5-day forecast_2024-01-31.csv'
+blob_date_pattern = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+# key=value directory in a hive partitioned path, eg. capture_date=2024-05-01/
+hive_partition_pattern = re.compile(r'(?:^|/)([^/=]+)=([^/]*)(?=/)')
+
+# file extension -> format used by write_df_to_gcs and the union readers
+file_format_extensions = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow'}
+file_format_content_types = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+
+# header part of a compose union, body parts are every other .csv in the parts folder
+compose_header_part_name = '_header.csv'
+
+class _HashingWriter(io.RawIOBase):
+    """Write-only stream that passes bytes through to stream while computing CRC32C and MD5"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.crc32c = google_crc32c.Checksum()
+        self.md5 = hashlib.md5()
+        self.byte_count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.crc32c.update(data)
+        self.md5.update(data)
+        self.byte_count += len(data)
+        return self.stream.write(data)
+
+    def tell(self):
+        return self.byte_count
+
+    def b64digests(self):
+        """Returns (crc32c, md5) base64 encoded, the form GCS reports them in"""
+        return (base64.b64encode(self.crc32c.digest()).decode('utf-8'), 
+                base64.b64encode(self.md5.digest()).decode('utf-8'))
+
 class GCSManager:
+    # Local mirror state kept by download_all_files_in_gcs_folder
+    sync_state_file_name = '.gcs_sync_state.json'
+    sync_state_checkpoint_every = 50
+
+    # stream_union_to_gcs: rows in the first chunk (used to size the rest) and how many copies
+    #  of a chunk are alive at once (parsed, cast to the schema, reindexed, serialized)
+    union_stream_initial_chunk_rows = 1000
+    union_stream_frame_copies = 4
+
+    # Per-process cache shared by every GCSManager, clients are created on first use
+    _clients = {}
+    _cache_lock = threading.RLock()
 
     def __init__(self):
         self.config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
@@ -23,80 +93,882 @@ class GCSManager:
             stream_logs=True,
             encoding='UTF-8'
             )
-        self.bq_client = bigquery.Client()
-        self.gcs_client = storage.Client()
+        # Every object read/write goes through the backend chosen by config.storage_backend
+        self.storage = get_storage_backend()
+        self.upload_stats = {'uploaded': 0, 'uploaded_bytes': 0, 'skipped': 0, 'skipped_bytes': 0}
+        self._upload_stats_lock = threading.Lock()
+
+    def _get_client(self, client_name, client_factory):
+        with GCSManager._cache_lock:
+            if client_name not in GCSManager._clients:
+                GCSManager._clients[client_name] = client_factory()
+            return GCSManager._clients[client_name]
+
+    @property
+    def bq_client(self):
+        return self._get_client('bq', bigquery.Client)
 
     # list all files/directories/blobs
     def list_gcs_blobs(self, bucket_name = 'rainday-gameday-bucket'):
-        blobs = self.gcs_client.list_blobs(bucket_name)
-        blobs_list = list(blobs)
+        blobs_list = list(self.storage.list_objects(bucket_name))
         self.logger.info('func list_gcs_blobs: finished')
         return blobs_list
 
+    @staticmethod
+    def _to_date(value):
+        if value is None or isinstance(value, date) and not isinstance(value, datetime):
+            return value
+        if isinstance(value, datetime):
+            return value.date()
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    @staticmethod
+    def parse_blob_date(blob_name):
+        """Returns the last YYYY-MM-DD date found in blob_name, or None"""
+        matches = blob_date_pattern.findall(blob_name)
+        if not matches:
+            return None
+        try:
+            return datetime.strptime(matches[-1], '%Y-%m-%d').date()
+        except ValueError:
+            return None
+
+    # lazily list blobs under a prefix
+    def iter_gcs_blobs(
+            self,
+            bucket_name,
+            prefix='',
+            suffix=None,
+            glob_pattern=None,
+            start_date=None,
+            end_date=None,
+            page_size=None,
+            start_offset=None,
+            end_offset=None
+            ):
+        """
+        Yields the blobs under prefix one page at a time, so only the prefix is listed
+        and callers can stop early without listing the rest.
+
+        Args:
+            bucket_name (str): The GCS bucket
+            prefix (str): Only blobs whose name starts with prefix are listed (server side)
+            suffix (str, optional): Only yield blobs whose name ends with suffix, eg. '.csv'
+            glob_pattern (str, optional): fnmatch pattern matched against the full blob name
+            start_date/end_date (str|date, optional): Inclusive range matched against the
+                YYYY-MM-DD date in the blob name, blobs without a date are skipped
+            page_size (int, optional): Results per list request, defaults to config.gcs_list_page_size
+            start_offset/end_offset (str, optional): Only list blob names >= start_offset and
+                < end_offset (server side, lexicographic)
+
+        Yields:
+            StorageObject
+        """
+        start_date = self._to_date(start_date)
+        end_date = self._to_date(end_date)
+        blobs = self.storage.list_objects(
+            bucket_name,
+            prefix=prefix, 
+            page_size=page_size or self.config.gcs_list_page_size,
+            start_offset=start_offset,
+            end_offset=end_offset
+            )
+
+        for blob in blobs:
+            # Skip directory placeholders
+            if blob.name.endswith('/'):
+                continue
+            if suffix and not blob.name.endswith(suffix):
+                continue
+            if glob_pattern and not fnmatch.fnmatchcase(blob.name, glob_pattern):
+                continue
+            if start_date or end_date:
+                blob_date = self.parse_blob_date(blob.name)
+                if blob_date is None:
+                    continue
+                if (start_date and blob_date < start_date) or (end_date and blob_date > end_date):
+                    continue
+            yield blob
+
+    @staticmethod
+    def get_file_format(blob_name):
+        """Returns 'csv', 'parquet' or 'arrow' from the blob_name extension, or None if unsupported"""
+        return file_format_extensions.get(os.path.splitext(blob_name)[1].lower())
+
+    @staticmethod
+    def format_partition_value(value):
+        if isinstance(value, (datetime, pd.Timestamp)):
+            value = value.date()
+        if isinstance(value, date):
+            return value.isoformat()
+        return quote(str(value), safe=' -_.')
+
+    @staticmethod
+    def get_partition_path(root_path, partition_values):
+        """Returns root_path/key=value/... for the (ordered) partition_values dict"""
+        segments = [f"{key}={GCSManager.format_partition_value(value)}" for key, value in partition_values.items()]
+        return '/'.join([root_path.rstrip('/')] + segments)
+
+    @staticmethod
+    def parse_partition_values(blob_name):
+        """Returns the hive style key=value directories in blob_name as a dict, eg. {'capture_date': '2024-05-01'}"""
+        return {key: unquote(value) for key, value in hive_partition_pattern.findall(blob_name)}
+
+    def iter_partitioned_blobs(
+            self, 
+            bucket_name, 
+            root_path, 
+            start_date=None, 
+            end_date=None, 
+            names=None, 
+            date_partition_column='capture_date'
+            ):
+        """
+        Yields the blobs of a hive partitioned dataset (see write_partitioned_df_to_gcs) whose
+        date partition is within start_date..end_date (inclusive) and, for datasets also
+        partitioned by name, whose name is in names.
+
+        Only the matching part of root_path is listed: a date range is passed to GCS as list
+        offsets (partition dates sort lexicographically), and with config.storage_partition_by_user
+        a bounded range with names lists each root/date=/name= prefix directly.
+        """
+        start_date = self._to_date(start_date)
+        end_date = self._to_date(end_date)
+        names = set(names) if names else None
+        root_prefix = root_path.rstrip('/') + '/'
+        date_prefix = f"{root_prefix}{date_partition_column}="
+
+        if start_date and end_date and names and self.config.storage_partition_by_user:
+            day_count = (end_date - start_date).days + 1
+            for day in (start_date + timedelta(days=i) for i in range(day_count)):
+                for name in sorted(names):
+                    name_prefix = self.get_partition_path(root_prefix, {date_partition_column: day, 'name': name}) + '/'
+                    yield from self.iter_gcs_blobs(bucket_name, prefix=name_prefix)
+            return
+
+        blobs = self.iter_gcs_blobs(
+            bucket_name, 
+            prefix=date_prefix,
+            start_offset=date_prefix + start_date.isoformat() if start_date else None,
+            end_offset=date_prefix + (end_date + timedelta(days=1)).isoformat() if end_date else None
+            )
+        for blob in blobs:
+            partition_values = self.parse_partition_values(blob.name[len(root_prefix):])
+            if names and 'name' in partition_values and partition_values['name'] not in names:
+                continue
+            yield blob
+
+    def read_partitioned_df(
+            self, 
+            bucket_name, 
+            root_path, 
+            start_date=None, 
+            end_date=None, 
+            names=None, 
+            date_partition_column='capture_date', 
+            schema=None, 
+            max_workers=None
+            ):
+        """
+        Reads the partitions of root_path matching start_date..end_date and names (see
+        iter_partitioned_blobs) into one df, with the partition columns restored from the
+        paths.  Returns None when nothing matches.
+        """
+        blobs = list(self.iter_partitioned_blobs(
+            bucket_name, root_path, 
+            start_date=start_date, 
+            end_date=end_date, 
+            names=names, 
+            date_partition_column=date_partition_column
+            ))
+        blobs = [blob for blob in blobs if self.get_file_format(blob.name) is not None]
+        if not blobs:
+            return None
+
+        df = pd.concat(self._read_blobs(blobs, max_workers=max_workers, schema=schema), ignore_index=True)
+        # Rows of datasets that aren't partitioned by name still need filtering
+        if names and 'name' in df.columns:
+            df = df[df['name'].isin(set(names))].reset_index(drop=True)
+        return df
+
+    def _is_union_source(self, blob_name, folder_location):
+        return (
+            blob_name.startswith(folder_location) 
+            and not blob_name.endswith('/') 
+            and self.get_file_format(blob_name) is not None
+            )
+
+    def _read_blob_to_df(self, blob, schema=None):
+        # Bytes are parsed directly, BytesIO shares the downloaded buffer rather than
+        #  copying it into a str first
+        file_format = self.get_file_format(blob.name)
+        buffer = io.BytesIO(blob.download_as_bytes())
+        if file_format == 'parquet':
+            df = pd.read_parquet(buffer)
+        elif file_format == 'arrow':
+            df = pa.ipc.open_file(buffer).read_pandas()
+        else:
+            df = pd.read_csv(buffer)
+
+        # Hive partitioned files don't store their partition columns, restore them from the path
+        for column, value in self.parse_partition_values(blob.name).items():
+            if column not in df.columns:
+                df[column] = value
+
+        if schema is not None:
+            df = coerce_df_to_schema(df, schema)
+        return df
+
+    def _write_df_to_stream(self, df, stream, file_format='csv', compression=None, schema=None, gzip_payload=False, csv_header=True):
+        """
+        Writes df to the binary stream as file_format ('csv', 'parquet' or 'arrow' IPC), 
+        config.gcs_upload_chunk_rows rows at a time so only one chunk is ever serialized in
+        memory, see _write_chunks_to_stream.
+        """
+        chunk_rows = max(1, int(self.config.gcs_upload_chunk_rows))
+        chunks = (df.iloc[chunk_start:chunk_start + chunk_rows] for chunk_start in range(0, max(len(df), 1), chunk_rows))
+        return self._write_chunks_to_stream(chunks, stream, file_format=file_format, compression=compression, schema=schema, gzip_payload=gzip_payload, csv_header=csv_header)
+
+    def _write_chunks_to_stream(self, chunks, stream, file_format='csv', compression=None, schema=None, gzip_payload=False, csv_header=True):
+        """
+        Writes each df in the chunks iterable to the binary stream as one file_format file
+        ('csv', 'parquet' or 'arrow' IPC), chunks must all have the same columns.  With a bq
+        schema each chunk is cast to the BigQuery types and typed files carry the matching
+        arrow schema so readers don't have to re-infer types.  gzip_payload compresses on the
+        fly, csv_header=False leaves out the csv header row.
+
+        Returns:
+            int: rows written
+        """
+        if file_format not in file_format_content_types:
+            raise ValueError(f"Unsupported file_format: {file_format}. Must be one of: {', '.join(file_format_content_types)}")
+
+        # mtime=0 keeps the gzip bytes identical for identical content
+        gzip_stream = gzip.GzipFile(fileobj=stream, mode='wb', mtime=0) if gzip_payload else None
+        sink = gzip_stream or stream
+        arrow_schema = None
+
+        text_sink = None
+        arrow_writer = None
+        row_count = 0
+        try:
+            for chunk_index, chunk in enumerate(chunks):
+                if schema is not None:
+                    chunk = coerce_df_to_schema(chunk, schema)
+                    if arrow_schema is None:
+                        arrow_schema = get_arrow_schema([field for field in schema if field.name in chunk.columns])
+                row_count += len(chunk)
+
+                if file_format == 'csv':
+                    if text_sink is None:
+                        text_sink = io.TextIOWrapper(sink, encoding='utf-8', newline='')
+                    # fixed date_format so every chunk formats datetimes the same way (pandas drops
+                    #  the time when a whole column is at midnight)
+                    chunk.to_csv(text_sink, index=False, header=(csv_header and chunk_index == 0), date_format='%Y-%m-%d %H:%M:%S')
+                    continue
+
+                table = pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False)
+                if arrow_writer is None:
+                    arrow_schema = table.schema
+                    if file_format == 'parquet':
+                        arrow_writer = pq.ParquetWriter(sink, arrow_schema, compression=compression or self.config.parquet_compression)
+                    else:
+                        arrow_writer = pa.ipc.new_file(sink, arrow_schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+                arrow_writer.write_table(table)
+        finally:
+            if text_sink is not None:
+                # detach so closing the wrapper doesn't close the underlying stream
+                text_sink.flush()
+                text_sink.detach()
+            if arrow_writer is not None:
+                arrow_writer.close()
+            if gzip_stream is not None:
+                gzip_stream.close()
+        return row_count
+
+    def _serialize_df(self, df, file_format='csv', compression=None, schema=None, gzip_payload=False, csv_header=True):
+        """Returns df serialized in memory as bytes, see _write_df_to_stream"""
+        file_object = io.BytesIO()
+        self._write_df_to_stream(df, file_object, file_format=file_format, compression=compression, schema=schema, gzip_payload=gzip_payload, csv_header=csv_header)
+        return file_object.getvalue()
+
+    def _read_blobs(self, blobs, max_workers=None, schema=None):
+        """
+        Reads each blob into a df on a pool of max_workers threads (default
+        config.gcs_union_max_workers, 1 runs sequentially) with at most 2*max_workers
+        downloads in flight.  Returns the dfs in the same order as blobs.
+        """
+        max_workers = max(1, int(max_workers or self.config.gcs_union_max_workers))
+        dfs = [] 
+        if max_workers == 1:
+            for blob in blobs:
+                self.logger.debug(f"Reading blob: {blob.name}")
+                dfs.append(self._read_blob_to_df(blob, schema))
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                in_flight = deque()
+                for blob in blobs:
+                    self.logger.debug(f"Reading blob: {blob.name}")
+                    in_flight.append(executor.submit(self._read_blob_to_df, blob, schema))
+                    if len(in_flight) >= 2 * max_workers:
+                        dfs.append(in_flight.popleft().result())
+                while in_flight:
+                    dfs.append(in_flight.popleft().result())
+        return dfs
+
     # Union blobs 
     def union_gcs_csv_blobs(
             self,
             blobs_list, 
-            csvs_to_union_folder_location=''
+            csvs_to_union_folder_location='',
+            max_workers=None,
+            schema=None
             ):
-        dfs = [] 
+        """
+        Unions the csv, parquet and arrow blobs in blobs_list under csvs_to_union_folder_location
+        into one df.  blobs_list can be a list or a generator (eg. iter_gcs_blobs), it is consumed
+        as a stream.  With a bq schema (eg. config.bq_schemas_historic_forecast) every file is
+        cast to the schema types before they are concatenated.
+
+        Blobs are downloaded and parsed in parallel (see _read_blobs) and the result is
+        concatenated in blobs_list order.
+        """
         self.logger.info("started union_gcs_csv_blobs")
         self.logger.info(f"This is the csvs_to_union_folder_location: {csvs_to_union_folder_location}")
-        self.logger.debug("This is the blobslist:")
-        self.logger.debug(blobs_list)
-
-        for blob in blobs_list:
-            self.logger.debug("This is the blob")
-            self.logger.debug(blob)
-            
-            if blob.name.startswith(csvs_to_union_folder_location) and blob.name.endswith('.csv') and not blob.name.endswith('/'):
-                csv_content = io.StringIO() 
-                csv_content.write(blob.download_as_text())
-                csv_content.seek(0)
-                df = pd.read_csv(csv_content)
-                
-                self.logger.debug("THIS IS THE df INSIDE OF union_gcs_csv_blobs loop:")
-                self.logger.debug(df)
-                
-                dfs.append(df)
-
-                self.logger.debug("THIS IS THE dfs INSIDE OF union_gcs_csv_blobs loop:")
-                self.logger.debug(dfs)
+
+        blobs_to_union = (
+            blob for blob in blobs_list 
+            if self._is_union_source(blob.name, csvs_to_union_folder_location)
+            )
+        dfs = self._read_blobs(blobs_to_union, max_workers=max_workers, schema=schema)
 
         unioned_dfs = pd.concat(dfs, ignore_index=True)
-        self.logger.info("This is the FINAL df")
+        self.logger.info(f"This is the FINAL df ({len(dfs)} blobs, {len(unioned_dfs)} rows)")
         self.logger.info(unioned_dfs.head(5))
 
         self.logger.info('func union_gcs_csv_blobs: finished')
         return unioned_dfs
 
-    def download_all_files_in_gcs_folder(self, bucket_name, folder_path, destination_folder):
-        # Create the destination folder if it doesn't exist
-        if not os.path.exists(destination_folder):
-            os.makedirs(destination_folder)
+    @staticmethod
+    def _union_manifest_path(unioned_filepath):
+        return unioned_filepath + '.manifest.json'
 
-        # Get the bucket
-        bucket = self.gcs_client.bucket(bucket_name)
+    def read_union_manifest(self, bucket_name, unioned_filepath):
+        """Returns the manifest stored next to unioned_filepath, or None if there isn't one"""
+        try:
+            return json.loads(self.storage.read_bytes(bucket_name, self._union_manifest_path(unioned_filepath)))
+        except NotFound:
+            return None
 
-        # List all blobs in the specified folder
-        blobs = bucket.list_blobs(prefix=folder_path)
-        self.logger.info("THIS IS THE BLOBS LIST")
-        self.logger.info(blobs)
-        # Download each file
-        for blob in blobs:
-            # Extract the file name from the blob name
-            file_name = blob.name.replace(folder_path, '')
-                    
-            # Skip if it's a directory placeholder (ends with '/')
-            if not file_name or file_name.endswith('/'):
+    def write_union_manifest(self, bucket_name, unioned_filepath, manifest):
+        """
+        Writes manifest next to unioned_filepath, recording the generation of the unioned
+        output it describes so an output rewritten by anything else forces a full rebuild
+        """
+        unioned_blob = self.storage.stat(bucket_name, unioned_filepath)
+        manifest['unioned_generation'] = unioned_blob.generation if unioned_blob else None
+        manifest['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.storage.write_bytes(
+            bucket_name, self._union_manifest_path(unioned_filepath),
+            json.dumps(manifest, indent=2), content_type='application/json'
+            )
+        self.logger.info(f"Wrote union manifest for {unioned_filepath} ({len(manifest['blobs'])} blobs)")
+
+    @staticmethod
+    def _apply_compactions_to_union_manifest(manifest, current_blobs, compaction_manifest):
+        """
+        Returns manifest with the merged daily blobs that a monthly compaction has replaced
+        swapped for the compacted file (see CompactionManager), so deleting them isn't taken
+        for a removal that forces a full rebuild.  A compacted file is only swapped in when
+        every one of its sources is already in the union, its rows then are too.
+        """
+        merged_blobs = dict(manifest['blobs'])
+        # (source name, generation) -> manifest entry holding its rows
+        covered_sources = {}
+        for blob_name, merged in merged_blobs.items():
+            for source in merged.get('sources', [[blob_name, merged['generation']]]):
+                covered_sources[tuple(source)] = blob_name
+
+        for month_entry in compaction_manifest['months'].values():
+            compacted_blob = current_blobs.get(month_entry['filepath'])
+            if compacted_blob is None or compacted_blob.generation != month_entry['generation']:
+                continue
+            merged = merged_blobs.get(compacted_blob.name)
+            if merged is not None and merged['generation'] == compacted_blob.generation:
                 continue
+            sources = [(source['name'], source['generation']) for source in month_entry['sources']]
+            if not all(source in covered_sources for source in sources):
+                continue
+            for source in sources:
+                merged_blobs.pop(covered_sources[source], None)
+            merged_blobs[compacted_blob.name] = {
+                'generation': compacted_blob.generation,
+                'crc32c': compacted_blob.crc32c,
+                'row_count': month_entry['row_count'],
+                'sources': [list(source) for source in sources]
+                }
+        return {**manifest, 'blobs': merged_blobs}
 
-            # Set the destination path
-            destination_path = os.path.join(destination_folder, file_name)
+    def union_gcs_csv_blobs_incremental(
+            self,
+            bucket_name,
+            blobs_list,
+            unioned_filepath,
+            csvs_to_union_folder_location='',
+            max_workers=None,
+            schema=None,
+            compaction_manifest=None
+            ):
+        """
+        Incremental version of union_gcs_csv_blobs.  A manifest (blob name, generation,
+        crc32c, row count) stored next to the unioned output records which blobs it already
+        contains, so only new blobs are downloaded and appended to the existing output.
+        Falls back to a full rebuild when there is no manifest, the unioned output changed,
+        or a previously merged blob changed or was removed.  Daily blobs replaced by a monthly
+        compacted file listed in compaction_manifest (CompactionManager.read_manifest) aren't
+        counted as removed, see _apply_compactions_to_union_manifest.
 
-            # Download the file
-            blob.download_to_filename(destination_path)
-            print(f"Downloaded {blob.name} to {destination_path}")
+        Returns:
+            tuple: (unioned df, or None if there was nothing new to merge,
+                    manifest to save with write_union_manifest once the df is written)
+        """
+        current_blobs = {
+            blob.name: blob for blob in blobs_list
+            if self._is_union_source(blob.name, csvs_to_union_folder_location)
+            }
+        manifest = self.read_union_manifest(bucket_name, unioned_filepath)
+        if manifest is not None and compaction_manifest is not None:
+            manifest = self._apply_compactions_to_union_manifest(manifest, current_blobs, compaction_manifest)
+
+        rebuild_reason = None
+        if manifest is None:
+            rebuild_reason = 'no manifest found'
+        else:
+            unioned_blob = self.storage.stat(bucket_name, unioned_filepath)
+            if unioned_blob is None or unioned_blob.generation != manifest.get('unioned_generation'):
+                rebuild_reason = 'unioned output is missing or was rewritten outside the manifest'
+            else:
+                for blob_name, merged in manifest['blobs'].items():
+                    blob = current_blobs.get(blob_name)
+                    if blob is None or blob.generation != merged['generation'] or blob.crc32c != merged['crc32c']:
+                        rebuild_reason = f'{blob_name} changed or was removed since it was merged'
+                        break
+
+        existing_df = None
+        if not rebuild_reason:
+            blobs_to_read = [blob for blob_name, blob in current_blobs.items() if blob_name not in manifest['blobs']]
+            if not blobs_to_read:
+                self.logger.info(f"{unioned_filepath} is up to date, no new blobs to merge")
+                return None, manifest
+
+            existing_df = self._read_blob_to_df(unioned_blob, schema)
+            expected_rows = sum(merged['row_count'] for merged in manifest['blobs'].values())
+            if len(existing_df) != expected_rows:
+                rebuild_reason = f'unioned output has {len(existing_df)} rows but the manifest expects {expected_rows}'
+                existing_df = None
+
+        if rebuild_reason:
+            self.logger.warning(f"Full rebuild of {unioned_filepath}: {rebuild_reason}")
+            blobs_to_read = list(current_blobs.values())
+            merged_blobs = {}
+        else:
+            merged_blobs = dict(manifest['blobs'])
+
+        self.logger.info(f"Merging {len(blobs_to_read)} blobs into {unioned_filepath}")
+        new_dfs = self._read_blobs(blobs_to_read, max_workers=max_workers, schema=schema)
+
+        for blob, df in zip(blobs_to_read, new_dfs):
+            merged_blobs[blob.name] = {'generation': blob.generation, 'crc32c': blob.crc32c, 'row_count': len(df)}
+
+        dfs = ([existing_df] if existing_df is not None else []) + new_dfs
+        unioned_df = pd.concat(dfs, ignore_index=True)
+        return unioned_df, {'blobs': merged_blobs}
+
+    def _iter_blob_chunks(self, blob, chunk_rows, schema=None):
+        """
+        Yields the rows of blob as dfs of at most chunk_rows() rows without holding the whole
+        file: csv through read_csv(chunksize), parquet by record batch and arrow IPC batch by
+        batch, each with its partition columns restored and cast to schema.
+        """
+        file_format = self.get_file_format(blob.name)
+        partition_values = self.parse_partition_values(blob.name)
+        read_buffer_bytes = self.config.union_stream_read_buffer_mb * 1024 * 1024
+
+        with self.storage.open_read(blob.bucket_name, blob.name, chunk_size=read_buffer_bytes) as reader:
+            if file_format == 'parquet':
+                parquet_file = pq.ParquetFile(reader)
+                frames = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_rows()))
+            elif file_format == 'arrow':
+                ipc_reader = pa.ipc.open_file(reader)
+                frames = (
+                    ipc_reader.get_batch(batch_index).slice(offset, chunk_rows()).to_pandas()
+                    for batch_index in range(ipc_reader.num_record_batches)
+                    for offset in range(0, ipc_reader.get_batch(batch_index).num_rows, chunk_rows())
+                    )
+            else:
+                frames = pd.read_csv(reader, chunksize=chunk_rows())
+
+            for frame in frames:
+                for column, value in partition_values.items():
+                    if column not in frame.columns:
+                        frame[column] = value
+                if schema is not None:
+                    frame = coerce_df_to_schema(frame, schema)
+                yield frame
+
+    def stream_union_to_gcs(
+            self, 
+            blobs_list, 
+            bucket_name, 
+            unioned_filepath, 
+            csvs_to_union_folder_location='', 
+            schema=None, 
+            file_format=None, 
+            max_memory_mb=None
+            ):
+        """
+        Memory bounded version of union_gcs_csv_blobs + write_df_to_gcs: every blob is read in
+        chunks (see _iter_blob_chunks) that are written straight to unioned_filepath, so the
+        unioned data is never in memory at once.  Columns are kept in the order of the schema
+        (or of the first chunk) and cast to the schema types, chunk by chunk.
+
+        The row count of the chunks is sized from the first chunk so that the frames in flight
+        (a parsed chunk plus its cast/serialized copies) stay within max_memory_mb (default
+        config.union_stream_max_memory_mb), after the read and upload buffers are set aside.
+
+        Returns:
+            dict: blobs, rows and the chunk_rows used
+        """
+        file_format = file_format or self.get_file_format(unioned_filepath) or 'csv'
+        gzip_payload = file_format == 'csv' and self.config.gcs_upload_gzip
+        max_memory_bytes = (max_memory_mb or self.config.union_stream_max_memory_mb) * 1024 * 1024
+        buffer_bytes = (self.config.union_stream_read_buffer_mb + self.config.gcs_upload_chunk_size_mb) * 1024 * 1024
+        frame_budget_bytes = max(max_memory_bytes - buffer_bytes, max_memory_bytes // 4)
+        if max_memory_bytes <= buffer_bytes:
+            self.logger.warning(f"union_stream_max_memory_mb is smaller than the read/upload buffers, using {frame_budget_bytes // (1024 * 1024)}MB for frames")
+
+        stats = {'blobs': 0, 'rows': 0, 'chunk_rows': self.union_stream_initial_chunk_rows}
+        union_blobs = (blob for blob in blobs_list if self._is_union_source(blob.name, csvs_to_union_folder_location))
+
+        def chunks():
+            columns = [field.name for field in schema] if schema is not None else None
+            is_sized = False
+            # Small daily files are buffered up to chunk_rows, so parquet/arrow row groups
+            #  aren't one per source file
+            pending, pending_rows = [], 0
+            for blob in union_blobs:
+                stats['blobs'] += 1
+                self.logger.debug(f"Streaming blob: {blob.name}")
+                for chunk in self._iter_blob_chunks(blob, lambda: stats['chunk_rows'], schema):
+                    if not is_sized and len(chunk):
+                        bytes_per_row = chunk.memory_usage(deep=True).sum() / len(chunk)
+                        stats['chunk_rows'] = max(1, int(frame_budget_bytes / (bytes_per_row * self.union_stream_frame_copies)))
+                        is_sized = True
+                    if columns is None:
+                        columns = list(chunk.columns)
+                    pending.append(chunk.reindex(columns=columns))
+                    pending_rows += len(chunk)
+                    if pending_rows >= stats['chunk_rows']:
+                        yield pd.concat(pending, ignore_index=True)
+                        pending, pending_rows = [], 0
+            if pending:
+                yield pd.concat(pending, ignore_index=True)
+            elif columns is not None and stats['blobs'] == 0:
+                # nothing to union, still write the header / an empty typed file
+                yield pd.DataFrame(columns=columns)
+
+        with self.storage.open_write(
+                bucket_name, unioned_filepath, 
+                content_type=file_format_content_types[file_format], 
+                content_encoding='gzip' if gzip_payload else None
+                ) as blob_writer:
+            counting_writer = _HashingWriter(blob_writer)
+            stats['rows'] = self._write_chunks_to_stream(chunks(), counting_writer, file_format=file_format, schema=schema, gzip_payload=gzip_payload)
+        self._count_upload('uploaded', counting_writer.byte_count)
+
+        self.logger.info(f"Streamed {stats['rows']} rows from {stats['blobs']} blobs into {unioned_filepath} ({stats['chunk_rows']} rows per chunk)")
+        return stats
+
+    @staticmethod
+    def _compose_parts_folder(unioned_filepath):
+        return unioned_filepath + '.parts/'
+
+    def write_union_part(self, df, bucket_name, unioned_filepath, part_name, schema):
+        """
+        Writes df as a headerless csv body part of unioned_filepath for union_mode 'compose',
+        in schema column order with the schema types so every part formats values the same
+        way.  The header part is written alongside only when it is missing or the schema
+        changed, keeping its generation (and so the union manifest) stable between runs.
+        Parts aren't gzipped, compose concatenates the stored bytes.
+        """
+        parts_folder = self._compose_parts_folder(unioned_filepath)
+        columns = [field.name for field in schema]
+        header_filepath = parts_folder + compose_header_part_name
+        header_bytes = self._serialize_df(pd.DataFrame(columns=columns), file_format='csv')
+        header_blob = self.storage.stat(bucket_name, header_filepath)
+        if header_blob is None or self.storage.read_bytes(bucket_name, header_filepath) != header_bytes:
+            self.storage.write_bytes(
+                bucket_name, header_filepath, header_bytes, 
+                content_type=file_format_content_types['csv'],
+                if_generation_match=header_blob.generation if header_blob else 0
+                )
+            self.logger.info(f"Wrote compose header part {header_filepath}")
+        part_filepath = f"{parts_folder}{part_name}.csv"
+        self.write_df_to_gcs(
+            df[columns], 
+            bucket_name=bucket_name, 
+            gcs_bucket_filepath=part_filepath, 
+            file_format='csv', 
+            schema=schema, 
+            gzip_compress=False, 
+            csv_header=False
+            )
+        return part_filepath
+
+    def _compose_tree(self, bucket_name, source_names, destination_name, if_generation_match=None):
+        """
+        Composes source_names, in order, into destination_name.  More than max_compose_sources
+        sources are first composed 32 at a time into temporary objects, level by level, and
+        the temporaries are deleted afterwards.  Returns the number of compose requests.
+        """
+        temp_prefix = f"{destination_name}.compose-tmp/"
+        temp_names = []
+        compose_requests = 0
+        names = list(source_names)
+        level = 0
+        try:
+            while len(names) > max_compose_sources:
+                groups = [names[i:i + max_compose_sources] for i in range(0, len(names), max_compose_sources)]
+                level_names = [f"{temp_prefix}{level}-{i:05d}" if len(group) > 1 else group[0] for i, group in enumerate(groups)]
+                with ThreadPoolExecutor(max_workers=self.config.gcs_union_max_workers) as executor:
+                    list(executor.map(
+                        lambda group, level_name: self.storage.compose(bucket_name, group, level_name, content_type='text/csv'),
+                        [group for group in groups if len(group) > 1],
+                        [level_name for group, level_name in zip(groups, level_names) if len(group) > 1]
+                        ))
+                compose_requests += sum(1 for group in groups if len(group) > 1)
+                temp_names += [level_name for level_name in level_names if level_name.startswith(temp_prefix)]
+                names = level_names
+                level += 1
+            self.storage.compose(bucket_name, names, destination_name, content_type='text/csv', if_generation_match=if_generation_match)
+            compose_requests += 1
+        finally:
+            if temp_names:
+                self.storage.delete_many(bucket_name, [(temp_name, None) for temp_name in temp_names])
+        return compose_requests
+
+    def compose_union(self, bucket_name, unioned_filepath):
+        """
+        Builds unioned_filepath server side from its header part and headerless body parts
+        (see write_union_part) with the compose API, so no rows are downloaded or uploaded.
+
+        The union manifest records the composed parts: when only new parts (sorting after the
+        composed ones) were added they are appended to the existing unioned object, otherwise
+        the header and every part are composed again.
+
+        Returns:
+            dict: parts composed, whether it was an append, compose requests made
+        """
+        parts_folder = self._compose_parts_folder(unioned_filepath)
+        header = self.storage.stat(bucket_name, parts_folder + compose_header_part_name)
+        if header is None:
+            raise ValueError(f"No header part at {parts_folder + compose_header_part_name}, write parts with write_union_part first")
+        parts = [
+            part for part in self.storage.list_objects(bucket_name, prefix=parts_folder)
+            if part.name != header.name and part.name.endswith('.csv') and '/' not in part.name[len(parts_folder):]
+            ]
+
+        manifest = self.read_union_manifest(bucket_name, unioned_filepath)
+        unioned_blob = self.storage.stat(bucket_name, unioned_filepath)
+        current_parts = {part.name: part for part in parts}
+        composed_parts = (manifest or {}).get('blobs', {})
+
+        can_append = (
+            manifest is not None
+            and manifest.get('header_generation') == header.generation
+            and unioned_blob is not None 
+            and unioned_blob.generation == manifest.get('unioned_generation')
+            and all(part_name in current_parts and current_parts[part_name].generation == composed['generation']
+                    for part_name, composed in composed_parts.items())
+            )
+        new_parts = [part for part in parts if part.name not in composed_parts]
+        if can_append and composed_parts and new_parts and min(part.name for part in new_parts) < max(composed_parts):
+            # a backfilled part would land out of order at the end, rebuild instead
+            can_append = False
+
+        if can_append and not new_parts:
+            self.logger.info(f"{unioned_filepath} is up to date, no new parts to compose")
+            return {'parts': 0, 'appended': True, 'compose_requests': 0}
+
+        if can_append:
+            source_names = [unioned_filepath] + [part.name for part in new_parts]
+            if_generation_match = unioned_blob.generation
+        else:
+            self.logger.info(f"Composing {unioned_filepath} from its header and {len(parts)} parts")
+            new_parts = parts
+            composed_parts = {}
+            source_names = [header.name] + [part.name for part in parts]
+            if_generation_match = None
+
+        compose_requests = self._compose_tree(bucket_name, source_names, unioned_filepath, if_generation_match=if_generation_match)
+        for part in new_parts:
+            composed_parts[part.name] = {'generation': part.generation, 'crc32c': part.crc32c}
+        self.write_union_manifest(bucket_name, unioned_filepath, {'blobs': composed_parts, 'header_generation': header.generation})
+        self.logger.info(f"Composed {len(new_parts)} parts into {unioned_filepath} with {compose_requests} compose requests")
+        return {'parts': len(new_parts), 'appended': can_append, 'compose_requests': compose_requests}
+
+    def _load_sync_state(self, state_filepath):
+        try:
+            with open(state_filepath, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_sync_state(self, state_filepath, sync_state):
+        # Temp file + rename so an interruption never leaves a truncated state file
+        fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(state_filepath), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(sync_state, file, indent=1, sort_keys=True)
+            os.replace(tmp_filepath, state_filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
+    @staticmethod
+    def _local_crc32c(filepath):
+        checksum = google_crc32c.Checksum()
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                checksum.update(block)
+        return base64.b64encode(checksum.digest()).decode('utf-8')
+
+    def _is_local_copy_current(self, blob, destination_path, state_entry):
+        if not os.path.isfile(destination_path):
+            return False
+        if state_entry:
+            return (state_entry['generation'] == blob.generation 
+                    and state_entry['crc32c'] == blob.crc32c
+                    and state_entry['local_size'] == os.path.getsize(destination_path))
+        # No state (eg. mirrored before the state file existed), gzip encoded objects are
+        #  stored decompressed locally so only identity-encoded files can be checked by content
+        return (blob.content_encoding != 'gzip' 
+                and os.path.getsize(destination_path) == blob.size 
+                and self._local_crc32c(destination_path) == blob.crc32c)
+
+    def _download_blob_to_path(self, blob, destination_path):
+        """
+        Downloads blob to a .part file next to destination_path and renames it into place.
+        The .part name carries the blob generation, so a download interrupted by a previous
+        run is resumed from its last byte when the object hasn't changed since.  .part files
+        left by other generations of the object are deleted.
+
+        Returns:
+            tuple(int, bool): bytes transferred and whether a partial download was resumed
+        """
+        os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+        part_filepath = f"{destination_path}.{blob.generation}.part"
+        destination_folder, destination_file_name = os.path.split(destination_path)
+        for file_name in os.listdir(destination_folder or '.'):
+            generation = file_name[len(destination_file_name) + 1:-len('.part')]
+            if (file_name.startswith(f"{destination_file_name}.") and file_name.endswith('.part')
+                    and generation.isdigit() and generation != str(blob.generation)):
+                os.remove(os.path.join(destination_folder, file_name))
+        offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+
+        # Byte ranges of gzip encoded objects are served decompressed, which can't be
+        #  appended to a partial file, so those always restart
+        resumed = 0 < offset < blob.size and blob.content_encoding != 'gzip'
+        if not resumed:
+            offset = 0
+
+        with open(part_filepath, 'ab' if resumed else 'wb') as file:
+            self.storage.download_to_file(
+                blob.bucket_name, blob.name, file, 
+                start=offset or None, 
+                if_generation_match=blob.generation
+                )
+
+        if resumed and self._local_crc32c(part_filepath) != blob.crc32c:
+            os.remove(part_filepath)
+            raise ValueError(f"Resumed download of {blob.name} failed its crc32c check, it will restart on the next sync")
+
+        os.replace(part_filepath, destination_path)
+        return blob.size - offset, resumed
+
+    def download_all_files_in_gcs_folder(self, bucket_name, folder_path, destination_folder, max_workers=None):
+        """
+        Mirrors the blobs under folder_path into destination_folder, downloading only the
+        files that are missing or differ from the bucket.
+
+        What has been mirrored (generation, crc32c and local size of each file) is kept in
+        destination_folder/.gcs_sync_state.json, a file is downloaded again when its remote
+        generation or crc32c no longer match.  Downloads run on a pool of max_workers threads
+        (default config.gcs_sync_max_workers) into .part files that are renamed into place
+        once complete, so an interrupted sync leaves no half written files and picks up where
+        it stopped when run again.
+
+        Returns:
+            dict: counts of downloaded, resumed, skipped and failed files and bytes_downloaded
+
+        Raises:
+            RuntimeError: if any file failed to download, after the others were synced
+        """
+        max_workers = max(1, int(max_workers or self.config.gcs_sync_max_workers))
+        os.makedirs(destination_folder, exist_ok=True)
+
+        state_filepath = os.path.join(destination_folder, self.sync_state_file_name)
+        sync_state = self._load_sync_state(state_filepath)
+        stats = {'downloaded': 0, 'resumed': 0, 'skipped': 0, 'failed': 0, 'bytes_downloaded': 0}
+        failures = []
+        state_lock = threading.Lock()
+
+        def sync_blob(blob, file_name, destination_path):
+            bytes_downloaded, resumed = self._download_blob_to_path(blob, destination_path)
+            with state_lock:
+                sync_state[file_name] = {
+                    'generation': blob.generation, 
+                    'crc32c': blob.crc32c, 
+                    'local_size': os.path.getsize(destination_path)
+                    }
+                stats['downloaded'] += 1
+                stats['resumed'] += int(resumed)
+                stats['bytes_downloaded'] += bytes_downloaded
+                # Checkpoint every so often so a killed sync doesn't repeat finished downloads
+                if stats['downloaded'] % self.sync_state_checkpoint_every == 0:
+                    self._save_sync_state(state_filepath, sync_state)
+            self.logger.debug(f"Downloaded {blob.name} to {destination_path}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for blob in self.iter_gcs_blobs(bucket_name, prefix=folder_path):
+                    # Extract the file name from the blob name
+                    file_name = blob.name[len(folder_path):].lstrip('/')
+                    if not file_name:
+                        continue
+
+                    destination_path = os.path.join(destination_folder, file_name)
+                    if self._is_local_copy_current(blob, destination_path, sync_state.get(file_name)):
+                        stats['skipped'] += 1
+                        continue
+                    futures[executor.submit(sync_blob, blob, file_name, destination_path)] = blob.name
+
+                for future, blob_name in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.error(f"Failed to download {blob_name}: {e}")
+                        failures.append(blob_name)
+        finally:
+            self._save_sync_state(state_filepath, sync_state)
+
+        stats['failed'] = len(failures)
+        self.logger.info(f"Synced gs://{bucket_name}/{folder_path} to {destination_folder}: {stats}")
+        if failures:
+            raise RuntimeError(f"{len(failures)} files failed to download: {', '.join(failures)}")
+        return stats
 
     #Creates big query table from GCS blob
     def create_bq_table_from_gcs(self,
@@ -191,17 +1063,10 @@ class GCSManager:
         #set/create variables
         gcs_blobpath = os.path.join(gcs_bucket_blobdir, gcs_blob_name)
 
-        # get the bucket that the file will be uploaded to.
-        bucket_object = self.gcs_client.get_bucket(bucket_name)
+        gcs_blobpath = gcs_blobpath.replace('\\', '/')
 
-        # Create a new local blob and download file to local directory
-        fileblob_object = bucket_object.blob(gcs_blobpath)
-        
-        gcs_blobpath = 'forecast_history_csv//all_historic_forecasts.csv'
-        fileblob_object.download_to_filename(gcs_blobpath)
-        
-        #read xlsx for return
-        df = pd.read_csv(gcs_blob_name)
+        #read csv for return
+        df = pd.read_csv(io.BytesIO(self.storage.read_bytes(bucket_name, gcs_blobpath)))
         
         if 'a' != 'a':
             message = ''
@@ -216,34 +1081,118 @@ class GCSManager:
             gcs_bucket_blobpath='your/bucket/blobpath.xlsx',
             is_testing_run=False
             ):
-        bucket_object = self.gcs_client.get_bucket(self.config.bucket_name)
         print('TODO: incomplete, currently uploading manually')
         return()
 
+    def _count_upload(self, outcome, byte_count):
+        with self._upload_stats_lock:
+            self.upload_stats[outcome] += 1
+            self.upload_stats[f'{outcome}_bytes'] += byte_count or 0
+
+    def _write_df_to_gcs_if_changed(self, df, bucket_name, gcs_bucket_filepath, content_type, content_encoding, **serialize_kwargs):
+        """
+        Serializes df in memory while computing its CRC32C and MD5, and only uploads it when
+        they differ from the existing object's (write_df_to_gcs only calls this for dfs under
+        config.gcs_stream_upload_min_rows rows).  The upload is conditional on the generation that was
+        compared (0 when there was no object), so a concurrent writer's object is never
+        silently overwritten; that case raises google.api_core.exceptions.PreconditionFailed.
+
+        Returns:
+            bool: True if the object was uploaded, False if it was skipped as unchanged
+        """
+        with io.BytesIO() as payload_file:
+            hashing_writer = _HashingWriter(payload_file)
+            self._write_df_to_stream(df, hashing_writer, **serialize_kwargs)
+            payload_crc32c, payload_md5 = hashing_writer.b64digests()
+
+            existing_blob = self.storage.stat(bucket_name, gcs_bucket_filepath)
+            if (existing_blob is not None 
+                    and existing_blob.crc32c == payload_crc32c 
+                    and existing_blob.md5_hash in (payload_md5, None)
+                    and existing_blob.content_encoding == content_encoding):
+                self.logger.info(f"Skipped upload of {gcs_bucket_filepath}, content unchanged ({hashing_writer.byte_count} bytes)")
+                self._count_upload('skipped', hashing_writer.byte_count)
+                return False
+
+            if_generation_match = existing_blob.generation if existing_blob is not None else 0
+            payload_file.seek(0)
+            self.storage.write_file(
+                bucket_name, gcs_bucket_filepath, payload_file, 
+                size=hashing_writer.byte_count,
+                content_type=content_type, 
+                content_encoding=content_encoding,
+                if_generation_match=if_generation_match
+                )
+        self._count_upload('uploaded', hashing_writer.byte_count)
+        return True
+
+    def get_upload_stats(self):
+        """Returns counts and bytes of uploaded and skipped (unchanged) writes from this GCSManager"""
+        with self._upload_stats_lock:
+            return dict(self.upload_stats)
+
     #Writes dataframe to specified bucket/path
     def write_df_to_gcs(self,
                         df, 
                         bucket_name = 'your_bucket_name', 
                         gcs_bucket_filepath = 'your/buckjet/filepath.csv', 
-                        is_testing_run=False):
+                        is_testing_run=False,
+                        file_format=None,
+                        compression=None,
+                        schema=None,
+                        gzip_compress=None,
+                        skip_unchanged=None,
+                        csv_header=True):
+        """
+        Writes df to gcs_bucket_filepath as csv, parquet or arrow IPC.  file_format defaults to
+        the one implied by the file extension (csv otherwise), compression applies to parquet
+        (snappy/zstd, default config.parquet_compression) and arrow (zstd/lz4), and a bq schema
+        types the columns (see _write_df_to_stream).
+
+        gzip_compress (default config.gcs_upload_gzip, csv only) stores the object gzipped with
+        Content-Encoding: gzip, GCS and the client libraries decompress it transparently on
+        download.  dfs of config.gcs_stream_upload_min_rows rows or more are streamed chunk by
+        chunk into a resumable upload so peak memory doesn't grow with the size of df.
+
+        skip_unchanged (default config.gcs_skip_unchanged_uploads, off) skips the upload when the
+        existing object already has the same content, see _write_df_to_gcs_if_changed.  It is
+        meant for small outputs rewritten with the same content (eg. the per-user latest
+        forecasts): it serializes the payload before uploading, so dfs of
+        gcs_stream_upload_min_rows rows or more are streamed as usual instead.
+        csv_header=False writes a headerless csv (eg. a compose union part, see write_union_part).
+        """
 
         if is_testing_run == True:
             df = pd.DataFrame(data=[[1,2,3],[4,5,6]],columns=['a','b','c'])
 
-        # get the bucket that the file will be uploaded to.
-        bucket_object = self.gcs_client.get_bucket(bucket_name)
+        file_format = file_format or self.get_file_format(gcs_bucket_filepath) or 'csv'
+        if gzip_compress is None:
+            gzip_compress = file_format == 'csv' and self.config.gcs_upload_gzip
+        content_type = file_format_content_types[file_format]
 
-        # Create a new blob and upload the file's content.
-        fileblob_object = bucket_object.blob(gcs_bucket_filepath)
+        content_encoding = 'gzip' if gzip_compress else None
 
-        # create/open and then write df to file object
-        file_object = io.StringIO()
-        df.to_csv(file_object, index=False)
-        file_object.seek(0) #move to beginning for using read() below
+        if skip_unchanged is None:
+            skip_unchanged = self.config.gcs_skip_unchanged_uploads
 
-        # upload from string and close file
-        fileblob_object.upload_from_string(file_object.read(), content_type="text/csv")
-        file_object.close()
+        if skip_unchanged and len(df) < self.config.gcs_stream_upload_min_rows:
+            uploaded = self._write_df_to_gcs_if_changed(
+                df, bucket_name, gcs_bucket_filepath, content_type, content_encoding,
+                file_format=file_format, compression=compression, schema=schema, gzip_payload=gzip_compress, csv_header=csv_header
+                )
+            if not uploaded:
+                return f"func write_df_to_gcs: finished\n  - Skipped {bucket_name} at location {gcs_bucket_filepath}, content unchanged"
+        elif len(df) >= self.config.gcs_stream_upload_min_rows:
+            if skip_unchanged:
+                self.logger.debug(f"{gcs_bucket_filepath}: {len(df)} rows, streamed without the unchanged check")
+            with self.storage.open_write(bucket_name, gcs_bucket_filepath, content_type=content_type, content_encoding=content_encoding) as blob_writer:
+                counting_writer = _HashingWriter(blob_writer)
+                self._write_df_to_stream(df, counting_writer, file_format=file_format, compression=compression, schema=schema, gzip_payload=gzip_compress, csv_header=csv_header)
+            self._count_upload('uploaded', counting_writer.byte_count)
+        else:
+            payload = self._serialize_df(df, file_format=file_format, compression=compression, schema=schema, gzip_payload=gzip_compress, csv_header=csv_header)
+            self.storage.write_bytes(bucket_name, gcs_bucket_filepath, payload, content_type=content_type, content_encoding=content_encoding)
+            self._count_upload('uploaded', len(payload))
         
         #error checking
         if 'a' != 'a':
@@ -252,6 +1201,44 @@ class GCSManager:
             message = f"func write_df_to_gcs: finished\n  - Wrote to {bucket_name} at location {gcs_bucket_filepath}"     
         return(message)
     
+    def write_partitioned_df_to_gcs(
+            self, 
+            df, 
+            bucket_name, 
+            root_path, 
+            partition_columns, 
+            file_format=None, 
+            schema=None
+            ):
+        """
+        Writes df as a hive partitioned dataset: one root_path/col=value/.../part-00000.<ext>
+        file per combination of partition_columns (eg. ['capture_date'] or ['capture_date', 'name']).
+        The partition columns are dropped from the files and restored from the path when read
+        (see _read_blob_to_df), which is also the layout BigQuery hive partitioned loads expect.
+        Rewriting a partition replaces its file.
+
+        Returns:
+            list: the written blob paths
+        """
+        file_format = file_format or self.config.daily_file_format
+        file_schema = [field for field in schema if field.name not in partition_columns] if schema is not None else None
+
+        written_paths = []
+        for partition_key, partition_df in df.groupby(partition_columns, sort=True):
+            partition_key = partition_key if isinstance(partition_key, tuple) else (partition_key,)
+            partition_path = self.get_partition_path(root_path, dict(zip(partition_columns, partition_key)))
+            gcs_filepath = f"{partition_path}/part-00000.{file_format}"
+            self.write_df_to_gcs(
+                df=partition_df.drop(columns=partition_columns),
+                bucket_name=bucket_name,
+                gcs_bucket_filepath=gcs_filepath,
+                file_format=file_format,
+                schema=file_schema
+                )
+            written_paths.append(gcs_filepath)
+        self.logger.info(f"Wrote {len(written_paths)} partitions under {root_path}")
+        return written_paths
+    
 def main():
     gcs_manager = GCSManager()
     gcs_blobs_list = gcs_manager.list_gcs_blobs(bucket_name='rainday-gameday-bucket')
@@ -0,0 +1,130 @@
+import threading
+
+import requests
+import openmeteo_requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from classes.ConfigManagerClass import ConfigManager
+from classes.LoggingClass import LoggingManager
+
+runtime_logger_level = 'INFO'
+
+# Shared across every pool so the counters cover all hosts (openweathermap, open-meteo)
+_connection_stats = {'new_connections': 0, 'connection_checkouts': 0}
+_connection_stats_lock = threading.Lock()
+
+def _count_connection_stat(stat_name):
+    with _connection_stats_lock:
+        _connection_stats[stat_name] += 1
+
+def _count_checkout(conn):
+    # A connection without an open socket (fresh, or reset after the server dropped it)
+    #  pays a new TCP/TLS handshake when the request is sent
+    _count_connection_stat('connection_checkouts')
+    if getattr(conn, 'sock', None) is None:
+        _count_connection_stat('new_connections')
+    return conn
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        return _count_checkout(super()._get_conn(timeout=timeout))
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return _count_checkout(super()._get_conn(timeout=timeout))
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool
+        }
+
+class _TimeoutSession(requests.Session):
+    """requests.Session that applies a default (connect, read) timeout to every request"""
+    def __init__(self, timeout):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+class HttpSessionManager:
+    """
+    Process wide factory for the pooled, keep-alive HTTP session shared by the
+    OpenWeatherMap and Open-Meteo retrievers.  Retry/backoff, pool size and
+    timeouts come from config.yaml.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = object.__new__(cls)
+                cls._instance.initialize_session()
+        return cls._instance
+
+    def initialize_session(self):
+        self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+        self.logging_manager = LoggingManager()
+        self.logger = self.logging_manager.create_logger(
+            logger_name='log_HttpSessionManager',
+            debug_level=runtime_logger_level,
+            stream_logs=True,
+            mode='a'
+        )
+
+        # raise_on_status=False returns the final response once retries are exhausted so
+        #  callers can still inspect the status code (eg. openmeteo_requests handles 400/429)
+        retries = Retry(
+            total=self.config.http_retries,
+            backoff_factor=self.config.http_backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET'],
+            raise_on_status=False
+        )
+        adapter = _CountingHTTPAdapter(
+            pool_connections=self.config.http_pool_connections,
+            pool_maxsize=self.config.http_pool_maxsize,
+            max_retries=retries
+        )
+
+        self.session = _TimeoutSession(
+            timeout=(self.config.http_connect_timeout_seconds, self.config.http_read_timeout_seconds)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # openmeteo_requests.Client closes its session in __del__, so a single client is
+        #  kept for the life of the process rather than one per retriever
+        self.openmeteo_client = openmeteo_requests.Client(session=self.session)
+        self.logger.info(f"HTTP session created (pool_maxsize: {self.config.http_pool_maxsize}, retries: {self.config.http_retries})")
+
+    def get_session(self):
+        return self.session
+
+    def get_openmeteo_client(self):
+        return self.openmeteo_client
+
+    def get_connection_stats(self):
+        """
+        Returns a dict with new_connections (TCP/TLS handshakes), reused_connections
+        (requests served on an already open keep-alive connection) and connection_checkouts
+        """
+        with _connection_stats_lock:
+            stats = dict(_connection_stats)
+        stats['reused_connections'] = max(0, stats['connection_checkouts'] - stats['new_connections'])
+        return stats
+
+if __name__ == '__main__':
+    http_session_manager = HttpSessionManager()
+    session = http_session_manager.get_session()
+    for _ in range(3):
+        session.get('https://api.openweathermap.org')
+    print(http_session_manager.get_connection_stats())
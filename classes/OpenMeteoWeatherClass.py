@@ -1,24 +1,31 @@
 #FORECASTS
-import openmeteo_requests
-
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from retry_requests import retry
 
 from classes.ConfigManagerClass import ConfigManager
 from classes.GCS import GCSManager
+from classes.HttpSessionManager import HttpSessionManager
 
 from classes.LoggingClass import LoggingManager
 
 runtime_logger_level = 'DEBUG'
 
+# schema_historic_weather column -> Open-Meteo hourly variable it is built from
+OPENMETEO_HOURLY_VARIABLES = {
+    'temp': 'temperature_2m',
+    'temp_humidity': 'relative_humidity_2m'
+}
+
+# Historic weather is kept at the same 3-hour resolution as the OpenWeatherMap forecasts
+HOURS_BETWEEN_ROWS = 3
+
 class WeatherHistoryRetriever:
     def __init__(self):
-        # Setup the Open-Meteo API client with cache and retry on error
-        #cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
-        #retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-        #self.openmeteo = openmeteo_requests.Client(session=retry_session)
-        self.openmeteo = openmeteo_requests.Client()
+        # Setup the Open-Meteo API client on the shared pooled session (retry/backoff and
+        #  timeouts are configured in HttpSessionManager)
+        self.http_session_manager = HttpSessionManager()
+        self.openmeteo = self.http_session_manager.get_openmeteo_client()
 
         # Setup Config manager and GCS client
         self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
@@ -26,6 +33,11 @@ class WeatherHistoryRetriever:
 
         self.date_today = datetime.now().strftime('%Y-%m-%d')
 
+        # Only request the hourly variables that end up in schema_historic_weather
+        self.historic_weather_columns = [field.name for field in self.config.bq_schemas_historic_weather]
+        self.hourly_columns = [column for column in self.historic_weather_columns if column in OPENMETEO_HOURLY_VARIABLES]
+        self.hourly_variables = [OPENMETEO_HOURLY_VARIABLES[column] for column in self.hourly_columns]
+
         self.logger = LoggingManager.create_logger(
             self,
             logger_name='OpenMeteoWeatherClass.py',
@@ -60,7 +72,7 @@ class WeatherHistoryRetriever:
             "longitude": longitude,
             "start_date": start_date,
             "end_date": end_date,
-            "hourly": ["temperature_2m", "relative_humidity_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "wind_speed_10m"]
+            "hourly": self.hourly_variables
         }
         responses = self.openmeteo.weather_api(url, params=params)
 
@@ -71,31 +83,75 @@ class WeatherHistoryRetriever:
 
         return pd.DataFrame(data=hourly_data)
 
+    def fetch_and_process_batch(self, users_details, start_date, end_date, batch_size=None):
+        """
+        Fetches historic weather for many users with one archive-api request per batch, the
+        API takes comma separated latitudes/longitudes and returns one response per location
+        in the same order.
+
+        Args:
+            users_details (list): user dicts with 'name', 'lat' and 'lon' (config.users_details)
+            batch_size (int, optional): locations per request, defaults to config.openmeteo_batch_size
+
+        Returns:
+            list: one df per entry of users_details, in the same order (users sharing a name
+                are kept apart)
+        """
+        url = "https://archive-api.open-meteo.com/v1/archive"
+        batch_size = max(1, int(batch_size or self.config.openmeteo_batch_size))
+        user_dfs = []
+
+        for batch_start in range(0, len(users_details), batch_size):
+            users_batch = users_details[batch_start:batch_start + batch_size]
+            params = {
+                "latitude": ','.join(str(user['lat']) for user in users_batch),
+                "longitude": ','.join(str(user['lon']) for user in users_batch),
+                "start_date": start_date,
+                "end_date": end_date,
+                "hourly": self.hourly_variables
+            }
+            self.logger.info(f"Fetching historic weather for {len(users_batch)} users in one request (batch starting at {batch_start})")
+            responses = self.openmeteo.weather_api(url, params=params)
+
+            if len(responses) != len(users_batch):
+                raise ValueError(f"Expected {len(users_batch)} responses from Open-Meteo but got {len(responses)}")
+
+            # Responses come back in request order, map each one back to its user
+            for user, response in zip(users_batch, responses):
+                hourly_data = self._process_hourly_data(response.Hourly(), user['name'])
+                user_dfs.append(pd.DataFrame(data=hourly_data))
+
+        return user_dfs
+
     def _process_hourly_data(self, hourly, name):
-        # Original columns from the function
-        variable_names = ["temperature_2m", "relative_humidity_2m", "apparent_temperature", "precipitation", "rain", "snowfall", "wind_speed_10m"]
-        variables = [hourly.Variables(i).ValuesAsNumpy() for i in range(len(variable_names))]
-        
-        # Create a dictionary for the data with new column names aligned with forecast_schema
+        """
+        Builds the schema_historic_weather df from an hourly response.  Only every
+        HOURS_BETWEEN_ROWS'th hour is kept, selected by strided slicing of the numpy
+        buffers so no intermediate df or full date range is built.
+        """
+        interval_seconds = hourly.Interval()
+        row_step_seconds = HOURS_BETWEEN_ROWS * 3600
+        step = max(1, row_step_seconds // interval_seconds)
+        start = hourly.Time()
+        value_count = (hourly.TimeEnd() - start) // interval_seconds
+
+        # Index of the first timestamp on an (UTC) hour divisible by HOURS_BETWEEN_ROWS
+        first_index = ((-start) % row_step_seconds) // interval_seconds
+        forecast_datetime = pd.to_datetime(
+            start + interval_seconds * np.arange(first_index, value_count, step, dtype='int64'),
+            unit='s'
+        )
+
+        # Create a dictionary for the data with column names aligned with schema_historic_weather
         hourly_data = {
-            "forecast_datetime": pd.date_range(
-                start=pd.to_datetime(hourly.Time(), unit="s"),
-                end=pd.to_datetime(hourly.TimeEnd(), unit="s"),
-                freq=pd.Timedelta(seconds=hourly.Interval()),
-                inclusive="left"
-            ),
-            "temp": variables[0],  # Assuming temperature_2m corresponds to temp
-            "temp_humidity": variables[1],  # Assuming relative_humidity_2m corresponds to temp_humidity
+            'weather_date': forecast_datetime.date,
+            'forecast_datetime': forecast_datetime,
         }
+        for i, column_name in enumerate(self.hourly_columns):
+            hourly_data[column_name] = hourly.Variables(i).ValuesAsNumpy()[first_index::step]
+        hourly_data['name'] = name
 
-        # Make df and add colukmns
-        df = pd.DataFrame(data=hourly_data)
-        df['name'] = name
-        df['weather_date'] = df['forecast_datetime'].dt.date
-
-        # Filter out rows where the hour is not divisible by 3 and order cols
-        df = df[df['forecast_datetime'].dt.hour % 3 == 0]
-        df = df[['weather_date', 'forecast_datetime','temp','temp_humidity','name']]
+        df = pd.DataFrame(data=hourly_data, columns=self.historic_weather_columns)
         
         self.logger.info("df.dtypes: ")
         self.logger.info(df.dtypes)
@@ -110,19 +166,10 @@ if __name__ == "__main__":
     date_today = datetime.now().strftime('%Y-%m-%d')
     users_details = config.users_details
 
-    dfs = []
-
     six_days_ago = (datetime.now() - timedelta(days=6)).strftime('%Y-%m-%d')
     start_date = six_days_ago
     end_date = six_days_ago
 
-    for user in users_details:
-        name = user['name']
-        lat = user['lat']
-        lon = user['lon']
-        print(f"Fetching data for {name}...")
-        df = wthr_history_retriever.fetch_and_process(lat, lon, start_date, end_date, name)
-        dfs.append(df)
-    
-    df_unioned = pd.concat(dfs, ignore_index=True)
+    user_dfs = wthr_history_retriever.fetch_and_process_batch(users_details, start_date, end_date)
+    df_unioned = pd.concat(user_dfs, ignore_index=True)
     print(df_unioned.head(5))
@@ -1,22 +1,36 @@
 #FORECASTS
 import os
-import requests
 import json
+import requests
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
-from schemas.bq_schemas import get_bq_schemas
 from classes.ConfigManagerClass import ConfigManager
 from classes.LoggingClass import LoggingManager
+from classes.HttpSessionManager import HttpSessionManager
+from classes.ResponseCache import ResponseCache
 
 runtime_logger_level = 'DEBUG'
 
+# OpenWeatherMap condition ids [500, 600) are the 'Rain' group
+#  https://openweathermap.org/weather-conditions
+RAIN_CONDITION_IDS = (500, 600)
+
 class WeatherForecastRetriever():
 
     def __init__(self):
 
         #load environment variables and config.yml
         self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+        self.forecast_field_names = [field.name for field in self.config.bq_schemas_historic_forecast]
+
+        #pooled keep-alive session shared with the Open-Meteo retriever
+        self.http_session_manager = HttpSessionManager()
+        self.session = self.http_session_manager.get_session()
+
+        #on-disk response cache keyed by location, provider and units
+        self.response_cache = ResponseCache() if self.config.forecast_cache_enabled else None
 
         #logger
         self.logging_manager = LoggingManager() 
@@ -38,18 +52,35 @@ class WeatherForecastRetriever():
         """Takes n parameters and outputs a weather forecast"""
         self.logger.info(f'getWeatherForecast() is running')
 
+        # Serve a fresh cached response for this location when there is one
+        cache_key = ResponseCache.make_key(lat, lon, provider='openweathermap', units='metric')
+        if self.response_cache is not None:
+            json_user_forecast = self.response_cache.get(cache_key)
+            if json_user_forecast is not None:
+                self.logger.info(f" - Using cached response for {cache_key}")
+                json_user_forecast['user_name'] = user_name
+                return json_user_forecast
+
         # Get open weather api key
-        getrequest = requests.get(f'https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&units=metric&appid={self.config.openweathermap_api_key}')
+        try:
+            getrequest = self.session.get(f'https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&units=metric&appid={self.config.openweathermap_api_key}')
+            status_code = getrequest.status_code
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f" - Request raised {type(e).__name__}: {e}")
+            getrequest = None
+            status_code = None
         
         message = ' - Using .env API KEY, getting lon/lat/user values'
         self.logger.info((f'{message}\n'
-            f' Got response (code: {getrequest.status_code})'))
+            f' Got response (code: {status_code})'))
 
-        #save response to json file `OR retieve a historic response for use
-        if getrequest.status_code == 200:
+        #save response to json file `OR retieve the most recent cached response for this location
+        if status_code == 200:
             
             #add request to variable
             json_user_forecast = getrequest.json()
+            if self.response_cache is not None:
+                self.response_cache.put(cache_key, json_user_forecast)
 
             if write_to_directory == True:
                 # Save the getrequest content to a local file
@@ -62,23 +93,13 @@ class WeatherForecastRetriever():
                     file.close              
                 self.logger.info(f" -Response type: {type(json_user_forecast)} (saved to {self.config.response_file_name}_{str(user_name)})")
         else:
-            #get the most recent (or whatever) response file in self.config.log_responses_directory
-            self.logger.error((f" - Request failed, loading a sample json response from internals"))
-
-            #iterate over log responses directory
-            for file in os.listdir(self.config.log_responses_directory):
-                filename = os.fsdecode(file)
-                if filename.endswith(".json"): 
-                    with open(os.path.join(self.config.log_responses_directory, filename),
-                                "r") as file:
-                        json_user_forecast = json.load(file)
-                        self.logger.info(type(json_user_forecast))
-                        file.close
-                    break
-                else: 
-                    #add request to variable
-                    json_user_forecast = {} 
-                    continue 
+            #fall back to the newest cached response for this location, even if past its ttl
+            json_user_forecast = None
+            if self.response_cache is not None:
+                json_user_forecast = self.response_cache.get(cache_key, allow_stale=True)
+            if json_user_forecast is None:
+                raise RuntimeError(f"Forecast request failed (code: {status_code}) and no cached response exists for {cache_key}")
+            self.logger.error((f" - Request failed, using the most recent cached response for {cache_key}"))
         
         #add usersname to json response data in local object
         json_user_forecast['user_name'] = user_name
@@ -96,106 +117,40 @@ class WeatherForecastRetriever():
         returns df, a dataframe. Takes a openweathermap request object's JSON data in the form of a 
         dictionary and moulds the data into a dataframe for comparing/working 
         with contained forecast data
+
+        Columns are pulled out of the forecast list in bulk and the df is built once with its
+        final dtypes.  Rain is classified from the numeric OWM condition id (see RAIN_CONDITION_IDS)
         """
+        self.logger.info(f'transformJsonForecast() is running')
 
-        bq_forecast_schema = get_bq_schemas()['schema_historic_forecast']
-        forecast_field_names = [field.name for field in bq_forecast_schema]
-        forecast_arrays = {field.name: [] for field in bq_forecast_schema}
-
-        # forecast_schema = [
-        #     'capture_date', 
-        #     'forecast_dateunix', 
-        #     'forecast_datetime',
-        #     'name', 
-        #     'rain_category', 
-        #     'rain_category_value', 
-        #     'temp', 
-        #     'temp_min', 
-        #     'temp_max', 
-        #     'temp_humidity', 
-        #     'weather_description'
-        #    ]
-        
-        # capture_dates  = []
-        # forecast_datesunix = []
-        # forecast_datestime = []
-        # forecast_usernames = []
-        # forecast_wthr_rain_categories = []
-        # forecast_wthr_rain_category_values = []
-        # forecast_wthr_temps = []
-        # forecast_wthr_temps_min = []
-        # forecast_wthr_temps_max = []
-        # forecast_wthr_temps_humidity = []
-        # forecast_wthr_weather_descriptions = []
-
-        self.logger.info("-------------------------")
-        self.logger.info("-------------------------")
-        self.logger.info("-------------------------")
-        self.logger.info("")
-        # Access specific data from the JSON
+        # Access specific data from the JSON, each entry is a single 3-hour forecast
         json_user_forecast_list = json_user_forecast['list']
-
-        #json_user_forecast_list now contains multiple forecasts. Review each and capture the
-        # date/rain status (=rain or !=rain) in lists for building a dataframe
-        self.logger.info(f'getWeatherForecast() is running')
-        for i, singleuserssingleforecast in enumerate(json_user_forecast_list):
-
-            #get date fields
-            todays_date = datetime.today().strftime('%Y-%m-%d')
-            capture_date= todays_date
-            forecast_arrays['capture_date'].append(capture_date)
-
-            forecast_dateunix = json_user_forecast_list[i]['dt']
-            forecast_arrays['forecast_dateunix'].append(forecast_dateunix)
-
-            forecast_datetime = pd.to_datetime(forecast_dateunix, unit='s')
-            forecast_arrays['forecast_datetime'].append(forecast_datetime)
-
-            forecast_username = json_user_forecast['user_name']
-            forecast_arrays['name'].append(forecast_username)
-
-            #get weather category and category value (1 = rain, 0 = no rain)
-            if 'rain' in json_user_forecast_list[i]["weather"][0]['main'].lower():
-                forecast_arrays['rain_category'].append('rain')
-                forecast_arrays['rain_category_value'].append('1')
-            else:
-                forecast_arrays['rain_category'].append('no rain')
-                forecast_arrays['rain_category_value'].append('0')
-
-            # Extract main weather details
-            main_weather = singleuserssingleforecast['main']
-            forecast_arrays['temp'].append(main_weather['temp'])
-            forecast_arrays['temp_min'].append(main_weather['temp_min'])
-            forecast_arrays['temp_max'].append(main_weather['temp_max'])
-            forecast_arrays['temp_humidity'].append(main_weather['humidity'])
-
-            # Extract weather description (assuming only one weather condition per entry)
-            weather_description = singleuserssingleforecast['weather'][0]['description']
-            forecast_arrays['weather_description'].append(weather_description)
-
-        # # TODO this section seems outside of normal practice
-        # # Add columns/arrays/series' to df.  TODO this will eventually be looped over 
-        # # each of the usernames contained in the yaml config file
-        # #https://stackoverflow.com/questions/30522724/take-multiple-lists-into-dataframe
-        # self.logger.info("ZIPPING LISTS NOW..................")
-        # zipped_lists = zip(
-        #     capture_dates, 
-        #     forecast_datesunix, 
-        #     forecast_datestime, 
-        #     forecast_usernames, 
-        #     forecast_wthr_rain_categories, 
-        #     forecast_wthr_rain_category_values,
-        #     forecast_wthr_temps,
-        #     forecast_wthr_temps_min,
-        #     forecast_wthr_temps_max,
-        #     forecast_wthr_temps_humidity,
-        #     forecast_wthr_weather_descriptions
-        #     )
-        
-        # list_of_zipped_lists = list(zipped_lists)
-
-        # forecast_df = pd.DataFrame(list_of_zipped_lists, columns=forecast_field_names)
-        forecast_df = pd.DataFrame(forecast_arrays, columns=forecast_field_names)
+        forecast_count = len(json_user_forecast_list)
+        mains = [forecast['main'] for forecast in json_user_forecast_list]
+        weathers = [forecast['weather'][0] for forecast in json_user_forecast_list]
+
+        #get date fields
+        forecast_dateunix = np.fromiter((forecast['dt'] for forecast in json_user_forecast_list), dtype='int64', count=forecast_count)
+
+        #get weather category and category value (1 = rain, 0 = no rain)
+        weather_ids = np.fromiter((weather['id'] for weather in weathers), dtype='int64', count=forecast_count)
+        is_rain = (weather_ids >= RAIN_CONDITION_IDS[0]) & (weather_ids < RAIN_CONDITION_IDS[1])
+
+        forecast_arrays = {
+            'capture_date': datetime.today().strftime('%Y-%m-%d'),
+            'forecast_dateunix': forecast_dateunix,
+            'forecast_datetime': pd.to_datetime(forecast_dateunix, unit='s'),
+            'name': json_user_forecast['user_name'],
+            'rain_category': np.where(is_rain, 'rain', 'no rain'),
+            'rain_category_value': is_rain.astype('int64'),
+            'temp': np.fromiter((main['temp'] for main in mains), dtype='float64', count=forecast_count),
+            'temp_min': np.fromiter((main['temp_min'] for main in mains), dtype='float64', count=forecast_count),
+            'temp_max': np.fromiter((main['temp_max'] for main in mains), dtype='float64', count=forecast_count),
+            'temp_humidity': np.fromiter((main['humidity'] for main in mains), dtype='int64', count=forecast_count),
+            'weather_description': [weather['description'] for weather in weathers]
+        }
+
+        forecast_df = pd.DataFrame(forecast_arrays, index=pd.RangeIndex(forecast_count), columns=self.forecast_field_names)
         
         return forecast_df
 
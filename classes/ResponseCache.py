@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from classes.ConfigManagerClass import ConfigManager
+from classes.LoggingClass import LoggingManager
+
+runtime_logger_level = 'INFO'
+
+class ResponseCache:
+    """
+    On-disk cache of API responses keyed by (lat, lon, provider, units).
+
+    Entries are json files in cache_directory, an index.json maps each key to its file and
+    timestamps so lookups never scan the directory.  Entries older than ttl_seconds are
+    stale: get() skips them but get(allow_stale=True) still serves them as a fallback.
+    When more than max_entries are stored the least recently used entry is evicted.
+    """
+    index_file_name = 'index.json'
+
+    def __init__(self, cache_directory=None, ttl_seconds=None, max_entries=None):
+        self.config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+        self.logging_manager = LoggingManager()
+        self.logger = self.logging_manager.create_logger(
+            logger_name='log_ResponseCache',
+            debug_level=runtime_logger_level,
+            stream_logs=True,
+            mode='a'
+        )
+
+        self.cache_directory = cache_directory or self.config.forecast_cache_directory
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.config.forecast_cache_ttl_seconds
+        self.max_entries = max_entries if max_entries is not None else self.config.forecast_cache_max_entries
+        self.index_filepath = os.path.join(self.cache_directory, self.index_file_name)
+
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'writes': 0, 'evictions': 0}
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        self.index = self._load_index()
+
+    @staticmethod
+    def make_key(lat, lon, provider, units):
+        return f"{provider}|{float(lat):.4f}|{float(lon):.4f}|{units}"
+
+    def _load_index(self):
+        # index is ordered least -> most recently used
+        try:
+            with open(self.index_filepath, 'r') as file:
+                entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return OrderedDict()
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1]['last_accessed_at']))
+
+    def _atomic_write_json(self, filepath, obj):
+        # Write to a temp file in the same directory then rename, so readers never see a partial file
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.cache_directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(obj, file)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
+
+    def _save_index(self):
+        self._atomic_write_json(self.index_filepath, self.index)
+
+    def get(self, key, allow_stale=False):
+        """
+        Returns the cached response for key, or None if there is no entry (or only a stale
+        entry and allow_stale is False).  allow_stale is the fallback after a fresh get() for
+        the same key, which already counted the miss, so it doesn't count one again
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                if not allow_stale:
+                    self.stats['misses'] += 1
+                return None
+
+            is_stale = (time.time() - entry['created_at']) > self.ttl_seconds
+            if is_stale and not allow_stale:
+                self.stats['misses'] += 1
+                return None
+
+            try:
+                with open(os.path.join(self.cache_directory, entry['file_name']), 'r') as file:
+                    response = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.logger.warning(f"Cache entry for {key} is missing or corrupt, removing it")
+                del self.index[key]
+                self._save_index()
+                if not allow_stale:
+                    self.stats['misses'] += 1
+                return None
+
+            # recency is persisted with the next put() rather than rewriting the index on every hit
+            entry['last_accessed_at'] = time.time()
+            self.index.move_to_end(key)
+            self.stats['stale_hits' if is_stale else 'hits'] += 1
+            return response
+
+    def put(self, key, response):
+        """Stores response under key and evicts the least recently used entries over max_entries"""
+        file_name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+        with self.lock:
+            self._atomic_write_json(os.path.join(self.cache_directory, file_name), response)
+            now = time.time()
+            self.index[key] = {'file_name': file_name, 'created_at': now, 'last_accessed_at': now}
+            self.index.move_to_end(key)
+            self.stats['writes'] += 1
+
+            while len(self.index) > self.max_entries:
+                evicted_key, evicted_entry = self.index.popitem(last=False)
+                evicted_filepath = os.path.join(self.cache_directory, evicted_entry['file_name'])
+                if os.path.exists(evicted_filepath):
+                    os.remove(evicted_filepath)
+                self.stats['evictions'] += 1
+                self.logger.debug(f"Evicted {evicted_key} from the response cache")
+
+            self._save_index()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.index)
+        return stats
+
+if __name__ == '__main__':
+    response_cache = ResponseCache()
+    key = ResponseCache.make_key(43.65, -79.38, provider='openweathermap', units='metric')
+    response_cache.put(key, {'list': []})
+    print(response_cache.get(key))
+    print(response_cache.get_stats())
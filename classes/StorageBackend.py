@@ -0,0 +1,585 @@
+import io
+import os
+import gzip
+import json
+import time
+import base64
+import shutil
+import hashlib
+import tempfile
+import itertools
+import threading
+
+import google_crc32c
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import storage
+from google.cloud.exceptions import NotFound
+
+from classes.ConfigManagerClass import ConfigManager
+from classes.LoggingClass import LoggingManager
+
+runtime_logger_level = 'INFO'
+
+# GCS compose accepts at most 32 source objects per request
+max_compose_sources = 32
+
+class StorageObject:
+    """
+    Metadata of a stored object, with the same attribute names as google.cloud.storage.Blob
+    (name, size, generation, crc32c, md5_hash, content_encoding, content_type) so code written
+    against blobs works unchanged on every backend.  crc32c/md5_hash are base64 encoded.
+    """
+    def __init__(self, backend, bucket_name, name, size=None, generation=None, crc32c=None,
+                 md5_hash=None, content_encoding=None, content_type=None, updated=None):
+        self.backend = backend
+        self.bucket_name = bucket_name
+        self.name = name
+        self.size = size
+        self.generation = generation
+        self.crc32c = crc32c
+        self.md5_hash = md5_hash
+        self.content_encoding = content_encoding
+        self.content_type = content_type
+        self.updated = updated
+
+    def download_as_bytes(self, raw_download=False):
+        return self.backend.read_bytes(self.bucket_name, self.name, raw=raw_download)
+
+    def download_as_text(self, encoding='utf-8'):
+        return self.download_as_bytes().decode(encoding)
+
+    def __repr__(self):
+        return f"<StorageObject: {self.bucket_name}, {self.name}, {self.generation}>"
+
+def _b64_checksums(data):
+    crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode('utf-8')
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode('utf-8')
+    return crc32c, md5
+
+def _b64_file_checksums(filepath, block_size=1024 * 1024):
+    crc32c = google_crc32c.Checksum()
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            crc32c.update(block)
+            md5.update(block)
+    return base64.b64encode(crc32c.digest()).decode('utf-8'), base64.b64encode(md5.digest()).decode('utf-8')
+
+class _CommitOnCloseWriter(io.RawIOBase):
+    """
+    Binary writer that buffers into a temp file and hands it to commit(temp_file) when closed,
+    so the object only becomes visible once complete.  Leaving a `with` block on an exception
+    discards the data instead.
+    """
+    def __init__(self, commit, directory=None):
+        self._commit = commit
+        self._temp_file = tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False)
+        self._aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._temp_file.write(data)
+
+    def tell(self):
+        return self._temp_file.tell()
+
+    def flush(self):
+        if not self.closed:
+            self._temp_file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._temp_file.close()
+        try:
+            if not self._aborted:
+                self._commit(self._temp_file.name)
+        finally:
+            if os.path.exists(self._temp_file.name):
+                os.remove(self._temp_file.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._aborted = exc_type is not None
+        self.close()
+
+class StorageBackend:
+    """
+    Object storage used by GCSManager: list, stat, read bytes, write streams, compose, copy
+    and delete objects addressed by (bucket_name, name).  Objects carry a generation that
+    changes on every write, and writes/deletes accept if_generation_match (0 = must not
+    exist) raising google.api_core.exceptions.PreconditionFailed like GCS does.  Objects
+    stored with content_encoding 'gzip' are decompressed by read_bytes unless raw=True.
+
+    Backends implement list_objects, stat, _read_raw, _commit and delete, the rest has
+    generic implementations that GCSStorageBackend replaces with native API calls.
+    """
+    name = None
+
+    def list_objects(self, bucket_name, prefix='', start_offset=None, end_offset=None, page_size=None):
+        """Yields the StorageObjects under prefix in name order, optionally within [start_offset, end_offset)"""
+        raise NotImplementedError
+
+    def stat(self, bucket_name, name):
+        """Returns the StorageObject for name, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def _read_raw(self, bucket_name, name):
+        raise NotImplementedError
+
+    def _commit(self, bucket_name, name, temp_filepath, content_type=None, content_encoding=None, if_generation_match=None):
+        raise NotImplementedError
+
+    def delete(self, bucket_name, name, if_generation_match=None):
+        raise NotImplementedError
+
+    def read_bytes(self, bucket_name, name, start=None, end=None, raw=False, if_generation_match=None):
+        """Returns the object's bytes (byte range start..end inclusive when given)"""
+        if if_generation_match is not None:
+            self._check_generation(bucket_name, name, if_generation_match)
+        data = self._read_raw(bucket_name, name)
+        stat = self.stat(bucket_name, name)
+        if not raw and stat is not None and stat.content_encoding == 'gzip':
+            data = gzip.decompress(data)
+        if start is not None or end is not None:
+            data = data[start or 0:(end + 1) if end is not None else None]
+        return data
+
+    def download_to_file(self, bucket_name, name, file_obj, start=None, if_generation_match=None):
+        file_obj.write(self.read_bytes(bucket_name, name, start=start, if_generation_match=if_generation_match))
+
+    def open_read(self, bucket_name, name, chunk_size=None):
+        """
+        Returns a binary reader over the object's (decompressed) content, backends that can
+        stream read it chunk_size bytes at a time rather than downloading it whole
+        """
+        return io.BytesIO(self.read_bytes(bucket_name, name))
+
+    def open_write(self, bucket_name, name, content_type=None, content_encoding=None, if_generation_match=None):
+        """Returns a binary writer, the object is written atomically when the writer is closed"""
+        return _CommitOnCloseWriter(
+            lambda temp_filepath: self._commit(
+                bucket_name, name, temp_filepath,
+                content_type=content_type,
+                content_encoding=content_encoding,
+                if_generation_match=if_generation_match
+                ),
+            directory=self._temp_directory(bucket_name, name)
+            )
+
+    def write_bytes(self, bucket_name, name, data, content_type=None, content_encoding=None, if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.open_write(bucket_name, name, content_type, content_encoding, if_generation_match) as writer:
+            writer.write(data)
+
+    def write_file(self, bucket_name, name, file_obj, size=None, content_type=None, content_encoding=None, if_generation_match=None):
+        with self.open_write(bucket_name, name, content_type, content_encoding, if_generation_match) as writer:
+            shutil.copyfileobj(file_obj, writer)
+
+    def compose(self, bucket_name, source_names, destination_name, content_type=None, content_encoding=None, if_generation_match=None):
+        """Writes the concatenation of up to max_compose_sources objects to destination_name"""
+        if len(source_names) > max_compose_sources:
+            raise ValueError(f"compose accepts at most {max_compose_sources} sources, got {len(source_names)}")
+        with self.open_write(bucket_name, destination_name, content_type, content_encoding, if_generation_match) as writer:
+            for source_name in source_names:
+                writer.write(self._read_raw(bucket_name, source_name))
+        return self.stat(bucket_name, destination_name)
+
+    def copy(self, bucket_name, name, destination_name, if_source_generation_match=None):
+        source = self.stat(bucket_name, name)
+        if source is None:
+            raise NotFound(f"{bucket_name}/{name}")
+        if if_source_generation_match is not None and source.generation != if_source_generation_match:
+            raise PreconditionFailed(f"{bucket_name}/{name} is not at generation {if_source_generation_match}")
+        self.write_bytes(bucket_name, destination_name, self._read_raw(bucket_name, name),
+                         content_type=source.content_type, content_encoding=source.content_encoding)
+
+    def delete_many(self, bucket_name, names_and_generations):
+        """Deletes each (name, generation) pair, objects missing or at another generation are kept"""
+        for name, generation in names_and_generations:
+            try:
+                self.delete(bucket_name, name, if_generation_match=generation)
+            except (NotFound, PreconditionFailed):
+                pass
+
+    def _temp_directory(self, bucket_name, name):
+        return None
+
+    def _check_generation(self, bucket_name, name, if_generation_match):
+        current = self.stat(bucket_name, name)
+        current_generation = current.generation if current is not None else 0
+        if current_generation != if_generation_match:
+            raise PreconditionFailed(f"{bucket_name}/{name} is at generation {current_generation}, expected {if_generation_match}")
+
+class GCSStorageBackend(StorageBackend):
+    """Google Cloud Storage, bucket handles are cached and built without a metadata request"""
+    name = 'gcs'
+
+    # Per-process, shared by every GCSManager
+    _client = None
+    _buckets = {}
+    _verified_buckets = set()
+    _cache_lock = threading.RLock()
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def client(self):
+        with GCSStorageBackend._cache_lock:
+            if GCSStorageBackend._client is None:
+                GCSStorageBackend._client = storage.Client()
+            return GCSStorageBackend._client
+
+    def get_bucket(self, bucket_name):
+        """
+        Returns a cached handle for bucket_name built with client.bucket(), which makes no API
+        request.  With config.gcs_verify_bucket_exists the bucket is checked once per process.
+        """
+        with GCSStorageBackend._cache_lock:
+            bucket_object = GCSStorageBackend._buckets.get(bucket_name)
+            if bucket_object is None:
+                bucket_object = self.client.bucket(bucket_name)
+                GCSStorageBackend._buckets[bucket_name] = bucket_object
+
+        if self.config.gcs_verify_bucket_exists and bucket_name not in GCSStorageBackend._verified_buckets:
+            if not bucket_object.exists():
+                raise NotFound(f"GCS bucket {bucket_name} does not exist")
+            GCSStorageBackend._verified_buckets.add(bucket_name)
+        return bucket_object
+
+    def _to_object(self, bucket_name, blob):
+        return StorageObject(
+            self, bucket_name, blob.name,
+            size=blob.size,
+            generation=blob.generation,
+            crc32c=blob.crc32c,
+            md5_hash=blob.md5_hash,
+            content_encoding=blob.content_encoding,
+            content_type=blob.content_type,
+            updated=blob.updated
+            )
+
+    def list_objects(self, bucket_name, prefix='', start_offset=None, end_offset=None, page_size=None):
+        blobs = self.get_bucket(bucket_name).list_blobs(
+            prefix=prefix,
+            page_size=page_size,
+            start_offset=start_offset,
+            end_offset=end_offset
+            )
+        for blob in blobs:
+            yield self._to_object(bucket_name, blob)
+
+    def stat(self, bucket_name, name):
+        blob = self.get_bucket(bucket_name).get_blob(name)
+        return self._to_object(bucket_name, blob) if blob is not None else None
+
+    def _read_raw(self, bucket_name, name):
+        return self.read_bytes(bucket_name, name, raw=True)
+
+    def read_bytes(self, bucket_name, name, start=None, end=None, raw=False, if_generation_match=None):
+        # crc32c is present on every object (md5 isn't on composed ones), ranges can't be checked
+        return self.get_bucket(bucket_name).blob(name).download_as_bytes(
+            start=start,
+            end=end,
+            raw_download=raw,
+            if_generation_match=if_generation_match,
+            checksum=None if start is not None or end is not None else 'crc32c'
+            )
+
+    def download_to_file(self, bucket_name, name, file_obj, start=None, if_generation_match=None):
+        self.get_bucket(bucket_name).blob(name).download_to_file(
+            file_obj,
+            start=start,
+            checksum=None if start else 'crc32c',
+            if_generation_match=if_generation_match
+            )
+
+    def open_read(self, bucket_name, name, chunk_size=None):
+        # Read the stored bytes and decompress locally, ranged reads of a gzip encoded object
+        #  aren't transcoded
+        stat = self.stat(bucket_name, name)
+        if stat is None:
+            raise NotFound(f"{bucket_name}/{name}")
+        reader = self.get_bucket(bucket_name).blob(name, generation=stat.generation).open(
+            'rb', chunk_size=chunk_size, raw_download=True
+            )
+        return gzip.GzipFile(fileobj=reader, mode='rb') if stat.content_encoding == 'gzip' else reader
+
+    def _new_blob(self, bucket_name, name, content_encoding=None):
+        blob = self.get_bucket(bucket_name).blob(name)
+        blob.content_encoding = content_encoding
+        return blob
+
+    def open_write(self, bucket_name, name, content_type=None, content_encoding=None, if_generation_match=None):
+        # Resumable upload in config.gcs_upload_chunk_size_mb chunks.  ignore_flush: the text/gzip
+        #  wrappers flush the writer, which a resumable upload can only do in whole chunks
+        return self._new_blob(bucket_name, name, content_encoding).open(
+            'wb',
+            content_type=content_type,
+            chunk_size=self.config.gcs_upload_chunk_size_mb * 1024 * 1024,
+            ignore_flush=True,
+            if_generation_match=if_generation_match
+            )
+
+    def write_bytes(self, bucket_name, name, data, content_type=None, content_encoding=None, if_generation_match=None):
+        self._new_blob(bucket_name, name, content_encoding).upload_from_string(
+            data, content_type=content_type, if_generation_match=if_generation_match
+            )
+
+    def write_file(self, bucket_name, name, file_obj, size=None, content_type=None, content_encoding=None, if_generation_match=None):
+        self._new_blob(bucket_name, name, content_encoding).upload_from_file(
+            file_obj, size=size, content_type=content_type, if_generation_match=if_generation_match
+            )
+
+    def compose(self, bucket_name, source_names, destination_name, content_type=None, content_encoding=None, if_generation_match=None):
+        if len(source_names) > max_compose_sources:
+            raise ValueError(f"compose accepts at most {max_compose_sources} sources, got {len(source_names)}")
+        bucket_object = self.get_bucket(bucket_name)
+        destination = self._new_blob(bucket_name, destination_name, content_encoding)
+        destination.content_type = content_type
+        destination.compose([bucket_object.blob(source_name) for source_name in source_names], if_generation_match=if_generation_match)
+        return self._to_object(bucket_name, destination)
+
+    def copy(self, bucket_name, name, destination_name, if_source_generation_match=None):
+        bucket_object = self.get_bucket(bucket_name)
+        bucket_object.copy_blob(
+            bucket_object.blob(name), bucket_object, destination_name,
+            if_source_generation_match=if_source_generation_match
+            )
+
+    def delete(self, bucket_name, name, if_generation_match=None):
+        self.get_bucket(bucket_name).blob(name).delete(if_generation_match=if_generation_match)
+
+    def delete_many(self, bucket_name, names_and_generations, batch_size=100):
+        # GCS batch requests are limited to 100 calls
+        bucket_object = self.get_bucket(bucket_name)
+        names_and_generations = list(names_and_generations)
+        for i in range(0, len(names_and_generations), batch_size):
+            with self.client.batch(raise_exception=False):
+                for name, generation in names_and_generations[i:i + batch_size]:
+                    bucket_object.blob(name).delete(if_generation_match=generation)
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Objects as files under root_directory/<bucket_name>/<name>.  Generation, checksums and
+    encoding are kept in a json sidecar under <bucket_name>/.storage_meta/, files copied in by
+    hand get their metadata computed on first use.  Writes go to a temp file that is renamed
+    into place.
+    """
+    name = 'local'
+    meta_folder_name = '.storage_meta'
+    _lock = threading.RLock()
+
+    def __init__(self, root_directory):
+        self.root_directory = root_directory
+
+    def _object_path(self, bucket_name, name):
+        return os.path.join(self.root_directory, bucket_name, *name.split('/'))
+
+    def _meta_path(self, bucket_name, name):
+        return os.path.join(self.root_directory, bucket_name, self.meta_folder_name, *name.split('/')) + '.json'
+
+    def _temp_directory(self, bucket_name, name):
+        directory = os.path.dirname(self._object_path(bucket_name, name))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _load_meta(self, bucket_name, name):
+        object_path = self._object_path(bucket_name, name)
+        try:
+            with open(self._meta_path(bucket_name, name), 'r') as file:
+                meta = json.load(file)
+            # A file replaced outside the backend no longer matches its sidecar
+            if meta['file_mtime_ns'] == os.stat(object_path).st_mtime_ns:
+                return meta
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+        crc32c, md5 = _b64_file_checksums(object_path)
+        file_mtime_ns = os.stat(object_path).st_mtime_ns
+        meta = {'size': os.path.getsize(object_path), 'generation': file_mtime_ns, 'crc32c': crc32c, 'md5_hash': md5,
+                'content_encoding': None, 'content_type': None, 'updated': file_mtime_ns / 1e9, 'file_mtime_ns': file_mtime_ns}
+        self._save_meta(bucket_name, name, meta)
+        return meta
+
+    def _save_meta(self, bucket_name, name, meta):
+        meta_path = self._meta_path(bucket_name, name)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        temp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temp_path, meta_path)
+
+    def _to_object(self, bucket_name, name, meta):
+        return StorageObject(self, bucket_name, name, **{key: meta[key] for key in
+                             ('size', 'generation', 'crc32c', 'md5_hash', 'content_encoding', 'content_type', 'updated')})
+
+    def list_objects(self, bucket_name, prefix='', start_offset=None, end_offset=None, page_size=None):
+        bucket_directory = os.path.join(self.root_directory, bucket_name)
+        # Only walk the deepest directory the prefix pins down
+        prefix_directory = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        walk_root = os.path.join(bucket_directory, *prefix_directory.split('/')) if prefix_directory else bucket_directory
+
+        names = []
+        for directory, subdirectories, file_names in os.walk(walk_root):
+            subdirectories[:] = [subdirectory for subdirectory in subdirectories if subdirectory != self.meta_folder_name]
+            relative_directory = os.path.relpath(directory, bucket_directory).replace(os.sep, '/')
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                name = file_name if relative_directory == '.' else f"{relative_directory}/{file_name}"
+                if not name.startswith(prefix):
+                    continue
+                if (start_offset and name < start_offset) or (end_offset and name >= end_offset):
+                    continue
+                names.append(name)
+
+        for name in sorted(names):
+            with self._lock:
+                if os.path.exists(self._object_path(bucket_name, name)):
+                    meta = self._load_meta(bucket_name, name)
+                else:
+                    continue
+            yield self._to_object(bucket_name, name, meta)
+
+    def stat(self, bucket_name, name):
+        with self._lock:
+            if not os.path.isfile(self._object_path(bucket_name, name)):
+                return None
+            return self._to_object(bucket_name, name, self._load_meta(bucket_name, name))
+
+    def _read_raw(self, bucket_name, name):
+        try:
+            with open(self._object_path(bucket_name, name), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            raise NotFound(f"{bucket_name}/{name}")
+
+    def open_read(self, bucket_name, name, chunk_size=None):
+        stat = self.stat(bucket_name, name)
+        if stat is None:
+            raise NotFound(f"{bucket_name}/{name}")
+        object_path = self._object_path(bucket_name, name)
+        return gzip.open(object_path, 'rb') if stat.content_encoding == 'gzip' else open(object_path, 'rb')
+
+    def _commit(self, bucket_name, name, temp_filepath, content_type=None, content_encoding=None, if_generation_match=None):
+        crc32c, md5 = _b64_file_checksums(temp_filepath)
+        with self._lock:
+            if if_generation_match is not None:
+                self._check_generation(bucket_name, name, if_generation_match)
+            object_path = self._object_path(bucket_name, name)
+            os.replace(temp_filepath, object_path)
+            self._save_meta(bucket_name, name, {
+                'size': os.path.getsize(object_path), 'generation': time.time_ns(), 'crc32c': crc32c, 'md5_hash': md5,
+                'content_encoding': content_encoding, 'content_type': content_type, 'updated': time.time(),
+                'file_mtime_ns': os.stat(object_path).st_mtime_ns
+                })
+
+    def delete(self, bucket_name, name, if_generation_match=None):
+        with self._lock:
+            if if_generation_match is not None:
+                self._check_generation(bucket_name, name, if_generation_match)
+            try:
+                os.remove(self._object_path(bucket_name, name))
+            except FileNotFoundError:
+                raise NotFound(f"{bucket_name}/{name}")
+            if os.path.exists(self._meta_path(bucket_name, name)):
+                os.remove(self._meta_path(bucket_name, name))
+
+class InMemoryStorageBackend(StorageBackend):
+    """Objects in a dict shared by every instance in the process, for tests and benchmarks"""
+    name = 'memory'
+    _buckets = {}
+    _generations = itertools.count(1)
+    _lock = threading.RLock()
+
+    def _bucket(self, bucket_name):
+        return InMemoryStorageBackend._buckets.setdefault(bucket_name, {})
+
+    def _to_object(self, bucket_name, name, entry):
+        return StorageObject(self, bucket_name, name, **entry['meta'])
+
+    def list_objects(self, bucket_name, prefix='', start_offset=None, end_offset=None, page_size=None):
+        with self._lock:
+            objects = [
+                self._to_object(bucket_name, name, entry) for name, entry in self._bucket(bucket_name).items()
+                if name.startswith(prefix)
+                    and not (start_offset and name < start_offset)
+                    and not (end_offset and name >= end_offset)
+                ]
+        yield from sorted(objects, key=lambda storage_object: storage_object.name)
+
+    def stat(self, bucket_name, name):
+        with self._lock:
+            entry = self._bucket(bucket_name).get(name)
+            return self._to_object(bucket_name, name, entry) if entry is not None else None
+
+    def _read_raw(self, bucket_name, name):
+        with self._lock:
+            entry = self._bucket(bucket_name).get(name)
+        if entry is None:
+            raise NotFound(f"{bucket_name}/{name}")
+        return entry['data']
+
+    def _commit(self, bucket_name, name, temp_filepath, content_type=None, content_encoding=None, if_generation_match=None):
+        with open(temp_filepath, 'rb') as file:
+            data = file.read()
+        crc32c, md5 = _b64_checksums(data)
+        with self._lock:
+            if if_generation_match is not None:
+                self._check_generation(bucket_name, name, if_generation_match)
+            self._bucket(bucket_name)[name] = {'data': data, 'meta': {
+                'size': len(data), 'generation': next(InMemoryStorageBackend._generations), 'crc32c': crc32c, 'md5_hash': md5,
+                'content_encoding': content_encoding, 'content_type': content_type, 'updated': time.time()
+                }}
+
+    def delete(self, bucket_name, name, if_generation_match=None):
+        with self._lock:
+            if if_generation_match is not None:
+                self._check_generation(bucket_name, name, if_generation_match)
+            if self._bucket(bucket_name).pop(name, None) is None:
+                raise NotFound(f"{bucket_name}/{name}")
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._buckets.clear()
+
+_storage_backends = {}
+_storage_backends_lock = threading.Lock()
+
+def get_storage_backend(backend_name=None):
+    """
+    Returns the process wide backend named by config.storage_backend ('gcs', 'local' or
+    'memory') unless backend_name is given.  The local backend stores under
+    config.storage_local_directory.
+    """
+    config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+    backend_name = backend_name or config.storage_backend
+    with _storage_backends_lock:
+        if backend_name not in _storage_backends:
+            if backend_name == 'gcs':
+                backend = GCSStorageBackend(config)
+            elif backend_name == 'local':
+                backend = LocalStorageBackend(config.storage_local_directory)
+            elif backend_name == 'memory':
+                backend = InMemoryStorageBackend()
+            else:
+                raise ValueError(f"Unsupported storage_backend: {backend_name}. Must be one of: gcs, local, memory")
+            LoggingManager().create_logger(
+                logger_name='log_StorageBackend',
+                debug_level=runtime_logger_level,
+                stream_logs=True,
+                mode='a'
+            ).info(f"Using the {backend_name} storage backend")
+            _storage_backends[backend_name] = backend
+        return _storage_backends[backend_name]
+
+if __name__ == '__main__':
+    storage_backend = get_storage_backend('memory')
+    storage_backend.write_bytes('bucket', 'folder/file.csv', b'a,b\n1,2\n', content_type='text/csv')
+    print(list(storage_backend.list_objects('bucket', prefix='folder/')))
+    print(storage_backend.read_bytes('bucket', 'folder/file.csv'))
@@ -4,6 +4,8 @@ import os
 from datetime import datetime, timedelta
 import base64
 import json
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import PreconditionFailed
 
 from classes.ConfigManagerClass import ConfigManager
 from classes.LoggingClass import LoggingManager
@@ -12,6 +14,7 @@ from classes.OpenWeatherMap import WeatherForecastRetriever
 from classes.OpenMeteoWeatherClass import WeatherHistoryRetriever
 from classes.PubSub import PubSubManager
 from classes.BigQueryManager import BigQueryManager
+from classes.CompactionManager import CompactionManager
 
 #os.environ['RAINDAY_IN_CLOUD_ENVIRONMENT'] = 'yes'
 runtime_logger_level = 'DEBUG'
@@ -39,6 +42,134 @@ class WeatherForecaster():
             mode='a'
         )
 
+    def _fetch_and_transform_user_forecast(self, user):
+        """
+        Gets and transforms the forecast for a single user from config.yml, returns a df
+        """
+        #grab user details for use in weather forecasting
+        user_name = user['name'] 
+        user_lat = user['lat'] 
+        user_lon = user['lon'] 
+        user_cityprovince = user['city-province'] 
+        self.logger.info(f"{user_name}, {user_cityprovince} ({user_lat}, {user_lon})")
+
+        #Takes users details from the yaml and gets a forecast 
+        json_forecast = self.forecast_manager.getWeatherForecast(
+            user_name = user_name,
+            lon = user_lon,
+            lat = user_lat,
+            write_to_directory=False
+            )
+        
+        #Transforms the forecast from forecast_manager.getWeatherForecast() to a usable format for
+        # caompring dates/times/weather conditions
+        json_forecast_details = self.forecast_manager.transformJsonForecast( 
+            json_forecast
+            )
+        return json_forecast_details
+
+    def _group_users_by_grid_cell(self, users):
+        """
+        Snaps each users lat/lon to a grid of config.forecast_geo_grid_degrees so nearby
+        users share one forecast request.  A grid size of 0 gives every user their own cell.
+
+        Returns:
+            list: (cell_user, user_indices) tuples in order of first appearance, cell_user is
+                  a user dict with the snapped coordinates used for the request
+        """
+        grid_degrees = float(self.config.forecast_geo_grid_degrees or 0)
+        cells = {}
+        for i, user in enumerate(users):
+            if grid_degrees > 0:
+                cell_lat = round(round(float(user['lat']) / grid_degrees) * grid_degrees, 6)
+                cell_lon = round(round(float(user['lon']) / grid_degrees) * grid_degrees, 6)
+                cell_key = (cell_lat, cell_lon)
+            else:
+                cell_lat, cell_lon = user['lat'], user['lon']
+                cell_key = i
+
+            if cell_key not in cells:
+                cells[cell_key] = ({'name': user['name'], 
+                                    'lat': cell_lat, 
+                                    'lon': cell_lon, 
+                                    'city-province': user['city-province']}, [])
+            cells[cell_key][1].append(i)
+
+        #name the cell after all of its users for logging
+        for cell_user, user_indices in cells.values():
+            cell_user['name'] = ', '.join(users[i]['name'] for i in user_indices)
+        return list(cells.values())
+
+    def _fetch_forecasts(self, users):
+        """
+        Fetches and transforms a forecast for each user, concurrently on a bounded thread pool
+        when config.forecast_fetch_mode is 'concurrent'.
+
+        Returns:
+            tuple: (list of dfs in the same order as users, None where the user failed,
+                    dict of index -> error message for each failed user)
+        """
+        forecast_dfs = [None] * len(users)
+        failures = {}
+
+        if self.config.forecast_fetch_mode == 'concurrent' and len(users) > 1:
+            max_workers = max(1, min(int(self.config.forecast_fetch_max_workers), len(users)))
+            self.logger.info(f"Fetching {len(users)} forecasts concurrently (max_workers: {max_workers})")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self._fetch_and_transform_user_forecast, user) for user in users]
+                for i, future in enumerate(futures):
+                    try:
+                        forecast_dfs[i] = future.result()
+                    except Exception as e:
+                        failures[i] = str(e)
+        else:
+            self.logger.info(f"Fetching {len(users)} forecasts sequentially")
+            for i, user in enumerate(users):
+                try:
+                    forecast_dfs[i] = self._fetch_and_transform_user_forecast(user)
+                except Exception as e:
+                    failures[i] = str(e)
+
+        return forecast_dfs, failures
+
+    def _fetch_user_forecasts(self, users):
+        """
+        Fetches one forecast per grid cell (see _group_users_by_grid_cell) and gives a copy,
+        renamed to the user, to every user in that cell.
+
+        Args:
+            users (list): user dicts from config.users_details
+
+        Returns:
+            tuple: (list of dfs in the same order as users, None where the user failed,
+                    list of (user_name, error message) for each failed user,
+                    number of forecast requests made)
+        """
+        cells = self._group_users_by_grid_cell(users)
+        cell_users = [cell_user for cell_user, _ in cells]
+        cell_dfs, cell_failures = self._fetch_forecasts(cell_users)
+
+        forecast_dfs = [None] * len(users)
+        failures = []
+        for cell_index, (cell_user, user_indices) in enumerate(cells):
+            for i in user_indices:
+                if cell_index in cell_failures:
+                    failures.append((users[i]['name'], cell_failures[cell_index]))
+                    continue
+                user_forecast_df = cell_dfs[cell_index].copy()
+                user_forecast_df['name'] = users[i]['name']
+                forecast_dfs[i] = user_forecast_df
+
+        for user_name, error in failures:
+            self.logger.error(f"Forecast failed for {user_name}, continuing with remaining users: {error}")
+        return forecast_dfs, failures, len(cells)
+
+    def _forecast_unioned_filepath(self):
+        return os.path.join(
+            self.config.wthr_forecast_unioned_folderpath, 
+            self.config.wthr_forecast_unioned_filename
+            ).replace('\\', '/')
+
     @functions_framework.http
     def get_weather_forecast_and_write_to_gcs(self):
         """
@@ -54,41 +185,50 @@ class WeatherForecaster():
         #set/declare variables/objects
         list_of_all_forecast_details_dfs = []
 
-        # config_users is iterated over to grab a forecast for each user
+        # config_users is fetched (concurrently by default) to grab a forecast for each user,
+        #  results are in the same order as config_users
         config_users = self.config.users_details
-        for user in config_users:
-
-            #grab user details for use in weather forecasting
-            user_name = user['name'] 
-            user_lat = user['lat'] 
-            user_lon = user['lon'] 
-            user_cityprovince = user['city-province'] 
-            self.logger.info(f"{user_name}, {user_cityprovince} ({user_lat}, {user_lon})")
-
-            #Takes users details from the yaml and gets a forecast 
-            json_forecast = self.forecast_manager.getWeatherForecast(
-                user_name = user_name,
-                lon = user_lon,
-                lat = user_lat,
-                write_to_directory=False
-                )
-            
-            #Transforms the forecast from forecast_manager.getWeatherForecast() to a usable format for
-            # caompring dates/times/weather conditions
-            json_forecast_details = self.forecast_manager.transformJsonForecast( 
-                json_forecast
-                )
-            
+        upload_stats_before = self.gcs_manager.get_upload_stats()
+        forecast_dfs, failures, forecast_request_count = self._fetch_user_forecasts(config_users)
+        dedup_ratio = len(config_users) / forecast_request_count if forecast_request_count else 0
+        self.logger.info(f"Geo dedup: {len(config_users)} users served by {forecast_request_count} forecast requests (ratio: {dedup_ratio:.2f})")
+        http_stats = self.forecast_manager.http_session_manager.get_connection_stats()
+        self.logger.info(f"HTTP connections: {http_stats['new_connections']} new, {http_stats['reused_connections']} reused")
+        if self.forecast_manager.response_cache is not None:
+            cache_stats = self.forecast_manager.response_cache.get_stats()
+            self.logger.info(f"Response cache: {cache_stats}")
+
+        for user, json_forecast_details in zip(config_users, forecast_dfs):
+            if json_forecast_details is None:
+                continue
+            user_name = user['name']
+
             #upload INDIVIDUAL forecast to GCS
             gcs_filepath=bcs_file_name_wout_date+'/'+'5-day forecast_'+user_name+'.csv'
-            self.gcs_manager.write_df_to_gcs(df=json_forecast_details, 
-                            bucket_name=bucket_name, 
-                            gcs_bucket_filepath=gcs_filepath, 
-                            is_testing_run=False)
+            # skip_unchanged uploads are conditional on the generation compared, a concurrent
+            #  writer fails them with PreconditionFailed: re-stat and retry once, then move on
+            for attempt in range(2):
+                try:
+                    self.gcs_manager.write_df_to_gcs(df=json_forecast_details, 
+                                    bucket_name=bucket_name, 
+                                    gcs_bucket_filepath=gcs_filepath, 
+                                    is_testing_run=False,
+                                    skip_unchanged=True)
+                    break
+                except PreconditionFailed as e:
+                    if attempt == 0:
+                        self.logger.warning(f"{gcs_filepath} was changed by another writer, retrying: {e}")
+                        continue
+                    self.logger.error(f"Failed to write {gcs_filepath}, it keeps being changed by another writer: {e}")
+                    failures.append((user_name, str(e)))
             
             #append df to new all forecasts list item and users name list item
             list_of_all_forecast_details_dfs.append(json_forecast_details)
 
+        if not list_of_all_forecast_details_dfs:
+            self.logger.error("No forecasts were retrieved for any user, nothing written to GCS")
+            return f"FAILED: No forecasts were retrieved ({len(failures)} of {len(config_users)} users failed)"
+
         #concatenate the list of DFs to a single DF for use in analysis/viz layer
         forecasts_details_concat = pd.concat(list_of_all_forecast_details_dfs)
 
@@ -96,13 +236,67 @@ class WeatherForecaster():
         self.logger.debug(forecasts_details_concat)
 
         #upload to GCS
-        gcs_filepath = gcs_folder_path+'/'+f'5-day forecast_{todays_date}'+'.csv'
-        self.gcs_manager.write_df_to_gcs(df=forecasts_details_concat, 
-                        bucket_name=bucket_name, 
-                        gcs_bucket_filepath=gcs_filepath, 
-                        is_testing_run=False)
+        if self.config.storage_layout == 'partitioned':
+            # gcs_folder_path/capture_date=YYYY-MM-DD/[name=<user>/]part-00000.<ext>
+            partition_columns = ['capture_date'] + (['name'] if self.config.storage_partition_by_user else [])
+            written_paths = self.gcs_manager.write_partitioned_df_to_gcs(
+                df=forecasts_details_concat,
+                bucket_name=bucket_name,
+                root_path=gcs_folder_path,
+                partition_columns=partition_columns,
+                schema=self.config.bq_schemas_historic_forecast
+                )
+            gcs_filepath = written_paths[0] if len(written_paths) == 1 else f"{gcs_folder_path}/capture_date={todays_date}/"
+        else:
+            gcs_filepath = gcs_folder_path+'/'+f'5-day forecast_{todays_date}'+'.'+self.config.daily_file_format
+            self.gcs_manager.write_df_to_gcs(df=forecasts_details_concat, 
+                            bucket_name=bucket_name, 
+                            gcs_bucket_filepath=gcs_filepath, 
+                            is_testing_run=False,
+                            schema=self.config.bq_schemas_historic_forecast)
+
+        # union_mode 'compose' unions headerless csv parts server side, write today's part
+        if self.config.union_mode == 'compose':
+            self.gcs_manager.write_union_part(
+                df=forecasts_details_concat,
+                bucket_name=bucket_name,
+                unioned_filepath=self._forecast_unioned_filepath(),
+                part_name=f'5-day forecast_{todays_date}',
+                schema=self.config.bq_schemas_historic_forecast
+                )
+
+        # Optional direct sink, rows are queryable before the union/load jobs run.  The daily files
+        #  stay the source of truth: the incremental MERGE later matches these rows on their key
+        storage_write_result = None
+        if self.config.bq_storage_write_forecasts:
+            storage_write_result = self.bq_manager.write_df_to_bq_storage(
+                df=forecasts_details_concat,
+                project_name=self.config.gcp_project_name,
+                dataset_name=self.config.bq_dataset_name,
+                table_name=self.config.bq_forecast_table_name,
+                schema=self.config.bq_schemas_historic_forecast,
+                partition_field=self.config.bq_forecast_partition_field,
+                clustering_fields=self.config.bq_forecast_clustering_fields
+                )
 
-        return(f"FINISHED: The list of forecasts has been saved to GCS bucket: {bucket_name} in location: {gcs_filepath}")
+        upload_stats = {stat_name: value - upload_stats_before[stat_name] for stat_name, value in self.gcs_manager.get_upload_stats().items()}
+        self.logger.info(f"GCS uploads: {upload_stats}")
+
+        message = (f"FINISHED: The list of forecasts has been saved to GCS bucket: {bucket_name} in location: {gcs_filepath}"
+                   f"\n  - Geo dedup: {len(config_users)} users / {forecast_request_count} forecast requests (ratio: {dedup_ratio:.2f})"
+                   f"\n  - HTTP connections: {http_stats['new_connections']} new, {http_stats['reused_connections']} reused"
+                   f"\n  - GCS uploads: {upload_stats['uploaded']} written, {upload_stats['skipped']} skipped as unchanged "
+                   f"({upload_stats['skipped_bytes']} bytes not re-uploaded)")
+        if self.config.bq_storage_write_forecasts:
+            message += (f"\n  - BigQuery Storage Write: {storage_write_result['rows']} rows" if storage_write_result
+                        else "\n  - BigQuery Storage Write: failed, rows will arrive with the next load")
+        if self.forecast_manager.response_cache is not None:
+            message += (f"\n  - Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                        f"{cache_stats['stale_hits']} stale hits")
+        if failures:
+            failed_names = ', '.join(user_name for user_name, _ in failures)
+            message += f"\n  - {len(failures)} of {len(config_users)} users failed: {failed_names}"
+        return(message)
 
 
     @functions_framework.http
@@ -129,27 +323,62 @@ class WeatherForecaster():
         # Define the GCS bucket and file information
         bucket_name = self.config.bucket_name
 
+        # 'compose' builds the unioned file from the daily csv parts without downloading them
+        if self.config.union_mode == 'compose':
+            gcs_filepath = self._forecast_unioned_filepath()
+            compose_result = self.gcs_manager.compose_union(bucket_name, gcs_filepath)
+            return print(f"FINISHED: The combined/unioned forecasts have been composed in GCS bucket: {bucket_name} in location: {gcs_filepath} "
+                         f"({compose_result['parts']} parts, {compose_result['compose_requests']} compose requests)")
+
         # Get all historic daily CSV files from the bucket and union them together
         #  - directory should contain multiple files  
-        blobs_list = self.gcs_manager.list_gcs_blobs(bucket_name=bucket_name)
-
-        unioned_forecasts = self.gcs_manager.union_gcs_csv_blobs(
-            blobs_list=blobs_list,
-            csvs_to_union_folder_location=self.config.wthr_forecast_folderpath
+        blobs_list = self.gcs_manager.iter_gcs_blobs(
+            bucket_name=bucket_name,
+            prefix=self.config.wthr_forecast_folderpath
+            )
+        # Daily files already merged into a monthly compacted file are skipped
+        compaction_manager = CompactionManager(self.gcs_manager)
+        blobs_list = compaction_manager.filter_compacted_sources(
+            bucket_name, self.config.wthr_forecast_csvpath, blobs_list
             )
 
         # Write the unioned forecasts to GCS. File will contain a row for every 
         # forecast_date_capture, forecast_time, user   
-        gcs_file_name = self.config.wthr_forecast_unioned_filename
-        wthr_forecast_unioned_folderpath = self.config.wthr_forecast_unioned_folderpath
+        gcs_filepath = self._forecast_unioned_filepath()
 
-        gcs_filepath = os.path.join(
-            wthr_forecast_unioned_folderpath, 
-            gcs_file_name
-            ).replace('\\', '/')
-  
-        # Coerce to pandas dattime object:
-        unioned_forecasts['forecast_datetime'] = pd.to_datetime(unioned_forecasts['forecast_datetime'])
+        # 'stream' writes the union chunk by chunk instead of holding it in memory
+        if self.config.union_mode == 'stream':
+            stream_result = self.gcs_manager.stream_union_to_gcs(
+                blobs_list=blobs_list,
+                bucket_name=bucket_name,
+                unioned_filepath=gcs_filepath,
+                csvs_to_union_folder_location=self.config.wthr_forecast_folderpath,
+                schema=self.config.bq_schemas_historic_forecast
+                )
+            return print(f"FINISHED: The combined/unioned forecasts have been streamed to GCS bucket: {bucket_name} in location: {gcs_filepath} "
+                         f"({stream_result['rows']} rows from {stream_result['blobs']} files)")
+
+        # 'incremental' only reads the daily files not yet in the union manifest
+        union_manifest = None
+        if self.config.union_mode == 'incremental':
+            unioned_forecasts, union_manifest = self.gcs_manager.union_gcs_csv_blobs_incremental(
+                bucket_name=bucket_name,
+                blobs_list=blobs_list,
+                unioned_filepath=gcs_filepath,
+                csvs_to_union_folder_location=self.config.wthr_forecast_folderpath,
+                schema=self.config.bq_schemas_historic_forecast,
+                compaction_manifest=compaction_manager.read_manifest(bucket_name, self.config.wthr_forecast_csvpath)[0]
+                )
+            if unioned_forecasts is None:
+                return print(f"FINISHED: The combined/unioned forecasts in GCS bucket: {bucket_name} location: {gcs_filepath} are already up to date")
+        else:
+            unioned_forecasts = self.gcs_manager.union_gcs_csv_blobs(
+                blobs_list=blobs_list,
+                csvs_to_union_folder_location=self.config.wthr_forecast_folderpath,
+                schema=self.config.bq_schemas_historic_forecast
+                )
+
+        # Columns (eg. forecast_datetime) are already cast to the schema types by the union
 
         # Write to GCS
         self.gcs_manager.write_df_to_gcs(
@@ -158,6 +387,8 @@ class WeatherForecaster():
             gcs_bucket_filepath=gcs_filepath,
             is_testing_run=False
             )
+        if union_manifest is not None:
+            self.gcs_manager.write_union_manifest(bucket_name, gcs_filepath, union_manifest)
         return print(f"FINISHED: The combined/unioned forecasts have been saved to GCS bucket: {bucket_name} in location: {gcs_filepath}")
      
 #entry point for rainday-gameday_get-union-and-store-forecasts
@@ -173,7 +404,6 @@ def main(request=None):
 #entry point for rainday-gameday_get-historic-openmeteo-weather
 @functions_framework.http
 def get_historic_weather(request=None):
-    dfs = []
     gcs_manager = GCSManager()
     config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
     wthr_history_retriever = WeatherHistoryRetriever()
@@ -188,22 +418,37 @@ def get_historic_weather(request=None):
     users_details = config.users_details
 
     try:
-        for user in users_details:
-            name = user['name']
-            lat = user['lat']
-            lon = user['lon']
-            print(f"Fetching data for {name}...")
-            df = wthr_history_retriever.fetch_and_process(lat, lon, start_date, end_date, name)
-            dfs.append(df)
-        df_unioned = pd.concat(dfs, ignore_index=True)
+        # One archive request per config.openmeteo_batch_size users
+        user_dfs = wthr_history_retriever.fetch_and_process_batch(users_details, start_date, end_date)
+        df_unioned = pd.concat(user_dfs, ignore_index=True)
 
         # Write daily historic wthr to GCS 
-        gcs_filepath = config.wthr_historic_csvpath+f'_{six_days_ago}.csv'
-        result = gcs_manager.write_df_to_gcs(
-            df=df_unioned,
-            bucket_name=config.bucket_name,
-            gcs_bucket_filepath=gcs_filepath
-        )
+        if config.storage_layout == 'partitioned':
+            # wthr_historic_csvpath/weather_date=YYYY-MM-DD/[name=<user>/]part-00000.<ext>
+            partition_columns = ['weather_date'] + (['name'] if config.storage_partition_by_user else [])
+            result = gcs_manager.write_partitioned_df_to_gcs(
+                df=df_unioned,
+                bucket_name=config.bucket_name,
+                root_path=config.wthr_historic_csvpath,
+                partition_columns=partition_columns,
+                schema=config.bq_schemas_historic_weather
+            )
+        else:
+            gcs_filepath = config.wthr_historic_csvpath+f'_{six_days_ago}.{config.daily_file_format}'
+            result = gcs_manager.write_df_to_gcs(
+                df=df_unioned,
+                bucket_name=config.bucket_name,
+                gcs_bucket_filepath=gcs_filepath,
+                schema=config.bq_schemas_historic_weather
+            )
+        if config.union_mode == 'compose':
+            gcs_manager.write_union_part(
+                df=df_unioned,
+                bucket_name=config.bucket_name,
+                unioned_filepath=config.wthr_historic_unioned_csvpath + '.csv',
+                part_name=f'historic_weather_{six_days_ago}',
+                schema=config.bq_schemas_historic_weather
+            )
         outcome='complete'
     except:
         outcome='failed'
@@ -253,21 +498,59 @@ def transform_historic_weather(
             logger.error("Error decoding message data as JSON.")
             return "Error in processing - message data not in JSON format"
 
+        if completion_status == 'complete' and self.config.union_mode == 'compose':
+            gcs_filepath = self.config.wthr_historic_unioned_csvpath + '.csv'
+            compose_result = self.gcs_manager.compose_union(self.config.bucket_name, gcs_filepath)
+            return f"Processed successfully: composed {compose_result['parts']} parts into {gcs_filepath}"
+
         if completion_status == 'complete':
             # Get daily historic weather data from GCS and union them
-            blobs_list = self.gcs_manager.list_gcs_blobs(bucket_name=self.config.bucket_name)
-            whtr_historic_unioned = self.gcs_manager.union_gcs_csv_blobs(
-                blobs_list=blobs_list,
-                csvs_to_union_folder_location=self.config.wthr_historic_csvpath
+            blobs_list = self.gcs_manager.iter_gcs_blobs(
+                bucket_name=self.config.bucket_name,
+                prefix=self.config.wthr_historic_csvpath
+            )
+            compaction_manager = CompactionManager(self.gcs_manager)
+            blobs_list = compaction_manager.filter_compacted_sources(
+                self.config.bucket_name, self.config.wthr_historic_csvpath, blobs_list
             )
+            gcs_filepath = self.config.wthr_historic_unioned_csvpath + '.csv'
+            if self.config.union_mode == 'stream':
+                stream_result = self.gcs_manager.stream_union_to_gcs(
+                    blobs_list=blobs_list,
+                    bucket_name=self.config.bucket_name,
+                    unioned_filepath=gcs_filepath,
+                    csvs_to_union_folder_location=self.config.wthr_historic_csvpath,
+                    schema=self.config.bq_schemas_historic_weather
+                )
+                return f"Processed successfully: streamed {stream_result['rows']} rows into {gcs_filepath}"
+
+            union_manifest = None
+            if self.config.union_mode == 'incremental':
+                whtr_historic_unioned, union_manifest = self.gcs_manager.union_gcs_csv_blobs_incremental(
+                    bucket_name=self.config.bucket_name,
+                    blobs_list=blobs_list,
+                    unioned_filepath=gcs_filepath,
+                    csvs_to_union_folder_location=self.config.wthr_historic_csvpath,
+                    schema=self.config.bq_schemas_historic_weather,
+                    compaction_manifest=compaction_manager.read_manifest(self.config.bucket_name, self.config.wthr_historic_csvpath)[0]
+                )
+                if whtr_historic_unioned is None:
+                    return f"Processed successfully: {gcs_filepath} is already up to date"
+            else:
+                whtr_historic_unioned = self.gcs_manager.union_gcs_csv_blobs(
+                    blobs_list=blobs_list,
+                    csvs_to_union_folder_location=self.config.wthr_historic_csvpath,
+                    schema=self.config.bq_schemas_historic_weather
+                )
 
             # Write unioned daily historic weather data to GCS
-            gcs_filepath = self.config.wthr_historic_unioned_csvpath + '.csv'
             message_result = self.gcs_manager.write_df_to_gcs(
                 df=whtr_historic_unioned,
                 bucket_name=self.config.bucket_name,
                 gcs_bucket_filepath=gcs_filepath
             )
+            if union_manifest is not None:
+                self.gcs_manager.write_union_manifest(self.config.bucket_name, gcs_filepath, union_manifest)
 
             # Return a success message or result
             return f"Processed successfully: {message_result}"
@@ -280,12 +563,90 @@ def transform_historic_weather(
         logger.error("No message data found in the cloud event.")
         return "Error: No message data found in the cloud event."
 
+#entry point for rainday-gameday_compact-daily-files
+@functions_framework.http
+def compact_daily_files(request=None):
+    """
+    Merges the daily forecast and historic weather files of each closed month into one
+    sorted parquet file per month (see classes/CompactionManager.py), so the unions and
+    BigQuery loads read a file per month instead of one per day.
+    """
+    config = ConfigManager(yaml_filepath='config', yaml_filename='config.yaml')
+    compaction_manager = CompactionManager()
+    logger.info("starting compact_daily_files:")
+
+    datasets = [
+        (config.wthr_forecast_csvpath, config.bq_schemas_historic_forecast, ['capture_date', 'name', 'forecast_datetime']),
+        (config.wthr_historic_csvpath, config.bq_schemas_historic_weather, ['weather_date', 'name', 'forecast_datetime'])
+    ]
+    message = "FINISHED: compact_daily_files"
+    for root_path, schema, sort_columns in datasets:
+        results = compaction_manager.compact_closed_months(config.bucket_name, root_path, schema, sort_columns)
+        compacted_files = sum(result['sources'] for result in results)
+        message += f"\n  - {root_path}: {len(results)} months compacted from {compacted_files} daily files"
+    logger.info(message)
+    return message
+
+def bq_load_daily_files(bq_manager, root_path, target_table_name, schema, merge_key, partition_field=None, clustering_fields=None):
+    """
+    Loads the daily (and compacted) files under root_path into target_table_name without the
+    GCS union: bq_load_mode 'incremental' MERGEs the files changed since the last load (see
+    BigQueryManager.incremental_load_bq_table_from_gcs), bq_load_source 'daily_files' replaces
+    the table with all of them (see BigQueryManager.load_bq_table_from_daily_files)
+    """
+    config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+    gcs_manager = GCSManager()
+    all_blobs = list(gcs_manager.iter_gcs_blobs(bucket_name=config.bucket_name, prefix=root_path))
+    # Daily files already merged into a monthly compacted file are skipped
+    source_blobs = list(CompactionManager(gcs_manager).filter_compacted_sources(
+        config.bucket_name, root_path,
+        (blob for blob in all_blobs if gcs_manager._is_union_source(blob.name, root_path))
+        ))
+
+    if config.bq_load_mode == 'incremental':
+        return bq_manager.incremental_load_bq_table_from_gcs(
+            project_name=config.gcp_project_name,
+            source_bucket_name=config.bucket_name,
+            source_root_path=root_path,
+            source_blobs=source_blobs,
+            target_dataset_name=config.bq_dataset_name,
+            target_table_name=target_table_name,
+            schema=schema,
+            merge_key=merge_key,
+            partition_field=partition_field,
+            clustering_fields=clustering_fields,
+            all_blob_names=[blob.name for blob in all_blobs]
+            )
+    return bq_manager.load_bq_table_from_daily_files(
+        project_name=config.gcp_project_name,
+        source_bucket_name=config.bucket_name,
+        source_root_path=root_path,
+        source_blobs=source_blobs,
+        target_dataset_name=config.bq_dataset_name,
+        target_table_name=target_table_name,
+        schema=schema,
+        all_blob_names=[blob.name for blob in all_blobs],
+        partition_field=partition_field,
+        clustering_fields=clustering_fields
+        )
+
 @functions_framework.cloud_event
 def bq_create_or_replace_historic_weather_unioned(
     cloud_event=None
     ):
     bq_manager = BigQueryManager()
     config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+
+    if config.bq_load_mode == 'incremental' or config.bq_load_source == 'daily_files':
+        return bq_load_daily_files(
+            bq_manager,
+            root_path=config.wthr_historic_csvpath,
+            target_table_name=config.bq_historic_table_name,
+            schema=config.bq_schemas_historic_weather,
+            merge_key=config.bq_historic_merge_key,
+            partition_field=config.bq_historic_partition_field,
+            clustering_fields=config.bq_historic_clustering_fields
+            )
     
     # Historic Weather
     bq_manager.create_or_replace_bq_table_from_gcs(
@@ -295,7 +656,9 @@ def bq_create_or_replace_historic_weather_unioned(
         source_file_name=config.wthr_historic_unioned_filename,
         target_dataset_name=config.bq_dataset_name,
         target_table_name=config.bq_historic_table_name,
-        schema=config.bq_schemas_historic_weather
+        schema=config.bq_schemas_historic_weather,
+        partition_field=config.bq_historic_partition_field,
+        clustering_fields=config.bq_historic_clustering_fields
         )
 
 @functions_framework.cloud_event
@@ -304,6 +667,17 @@ def bq_create_or_replace_historic_forecasts_unioned(
     ):
     bq_manager = BigQueryManager()
     config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+
+    if config.bq_load_mode == 'incremental' or config.bq_load_source == 'daily_files':
+        return bq_load_daily_files(
+            bq_manager,
+            root_path=config.wthr_forecast_csvpath,
+            target_table_name=config.bq_forecast_table_name,
+            schema=config.bq_schemas_historic_forecast,
+            merge_key=config.bq_forecast_merge_key,
+            partition_field=config.bq_forecast_partition_field,
+            clustering_fields=config.bq_forecast_clustering_fields
+            )
     
     # Historic Forecasts
     bq_manager.create_or_replace_bq_table_from_gcs(
@@ -313,9 +687,118 @@ def bq_create_or_replace_historic_forecasts_unioned(
         source_file_name=config.wthr_forecast_unioned_filename,
         target_dataset_name=config.bq_dataset_name,
         target_table_name=config.bq_forecast_table_name,
-        schema=config.bq_schemas_historic_forecast
+        schema=config.bq_schemas_historic_forecast,
+        partition_field=config.bq_forecast_partition_field,
+        clustering_fields=config.bq_forecast_clustering_fields
         )
 
+#entry point for the nightly BigQuery refresh of both tables
+@functions_framework.http
+def bq_refresh_all_tables(request=None):
+    """
+    Loads the historic weather and forecast tables at the same time instead of one entry point
+    after the other: truncate loads from the unioned csvs are submitted together and polled
+    together (BigQueryManager.refresh_tables_from_gcs), loads from the daily files run one table
+    per thread, each submitting its load jobs together.  Returns a summary line per job.
+    """
+    bq_manager = BigQueryManager()
+    config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+    logger.info("starting bq_refresh_all_tables:")
+
+    tables = [
+        {
+            'root_path': config.wthr_historic_csvpath,
+            'source_dir_path': config.wthr_historic_unioned_folderpath,
+            'source_file_name': config.wthr_historic_unioned_filename,
+            'target_table_name': config.bq_historic_table_name,
+            'schema': config.bq_schemas_historic_weather,
+            'merge_key': config.bq_historic_merge_key,
+            'partition_field': config.bq_historic_partition_field,
+            'clustering_fields': config.bq_historic_clustering_fields
+        },
+        {
+            'root_path': config.wthr_forecast_csvpath,
+            'source_dir_path': config.wthr_forecast_unioned_folderpath,
+            'source_file_name': config.wthr_forecast_unioned_filename,
+            'target_table_name': config.bq_forecast_table_name,
+            'schema': config.bq_schemas_historic_forecast,
+            'merge_key': config.bq_forecast_merge_key,
+            'partition_field': config.bq_forecast_partition_field,
+            'clustering_fields': config.bq_forecast_clustering_fields
+        }
+    ]
+
+    if config.bq_load_mode == 'incremental' or config.bq_load_source == 'daily_files':
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            results = list(executor.map(
+                lambda table: bq_load_daily_files(
+                    bq_manager,
+                    root_path=table['root_path'],
+                    target_table_name=table['target_table_name'],
+                    schema=table['schema'],
+                    merge_key=table['merge_key'],
+                    partition_field=table['partition_field'],
+                    clustering_fields=table['clustering_fields']
+                    ),
+                tables
+                ))
+        job_summaries = [summary for result in results if result for summary in result['jobs']]
+        failed_tables = [table['target_table_name'] for table, result in zip(tables, results) if result is None]
+    else:
+        job_summaries = bq_manager.refresh_tables_from_gcs([
+            {
+                'project_name': config.gcp_project_name,
+                'source_bucket_name': config.bucket_name,
+                'source_dir_path': table['source_dir_path'],
+                'source_file_name': table['source_file_name'],
+                'target_dataset_name': config.bq_dataset_name,
+                'target_table_name': table['target_table_name'],
+                'schema': table['schema'],
+                'partition_field': table['partition_field'],
+                'clustering_fields': table['clustering_fields']
+            }
+            for table in tables
+            ])
+        failed_tables = [summary['label'] for summary in job_summaries if summary['state'] != 'DONE' or summary['error']]
+
+    message = f"FINISHED: bq_refresh_all_tables, {len(job_summaries)} jobs"
+    for summary in job_summaries:
+        message += (f"\n  - {summary['label']}: {summary['state']}, {summary['bytes']} bytes, "
+                    f"{summary['slot_ms']} slot ms, {summary['duration_seconds']}s")
+    if failed_tables:
+        message += f"\n  - failed: {', '.join(failed_tables)}"
+    logger.info(message)
+    return message
+
+#entry point for the one-off partitioning/clustering migration, run by hand
+@functions_framework.http
+def bq_migrate_table_layouts(request=None):
+    """
+    Rebuilds the historic weather and forecast tables with the configured partitioning and
+    clustering (bq_*_partition_field, bq_*_clustering_fields) when they are laid out
+    differently, see BigQueryManager.migrate_table_layout.  The loads only create missing
+    tables with the layout, so this is run once by hand after changing it.
+    """
+    bq_manager = BigQueryManager()
+    config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+    logger.info("starting bq_migrate_table_layouts:")
+
+    tables = [
+        (config.bq_historic_table_name, config.bq_historic_partition_field, config.bq_historic_clustering_fields),
+        (config.bq_forecast_table_name, config.bq_forecast_partition_field, config.bq_forecast_clustering_fields)
+    ]
+    message = "FINISHED: bq_migrate_table_layouts"
+    for table_name, partition_field, clustering_fields in tables:
+        table_fullqual = f"{config.gcp_project_name}.{config.bq_dataset_name}.{table_name}"
+        try:
+            table = bq_manager.migrate_table_layout(bq_manager.bq_client.get_table(table_fullqual), partition_field, clustering_fields)
+            message += f"\n  - {table_name}: partitioned by {table.time_partitioning.field if table.time_partitioning else None}, clustered by {table.clustering_fields}"
+        except Exception as e:
+            logger.error(f"Migrating {table_name} failed: {e}")
+            message += f"\n  - {table_name}: failed, {e}"
+    logger.info(message)
+    return message
+
 if __name__ == '__main__':
     config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
     weather_forecaster = WeatherForecaster()
@@ -326,4 +809,7 @@ if __name__ == '__main__':
     # transform_historic_weather()
     # bq_create_or_replace_historic_weather_unioned()
     #weather_forecaster.union_and_write_gcs_blob_forecasts_to_gcs()
-    #bq_create_or_replace_historic_forecasts_unioned()
\ No newline at end of file
+    #bq_create_or_replace_historic_forecasts_unioned()
+    # bq_refresh_all_tables()
+    # compact_daily_files()
+    # bq_migrate_table_layouts()
\ No newline at end of file
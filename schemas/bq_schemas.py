@@ -1,6 +1,31 @@
+import pandas as pd
+import pyarrow as pa
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+# BigQuery field type -> arrow type used for typed (parquet/arrow) files
+bq_to_arrow_types = {
+    'DATE': pa.date32(),
+    'DATETIME': pa.timestamp('us'),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+    'INTEGER': pa.int64(),
+    'FLOAT': pa.float64(),
+    'STRING': pa.string(),
+}
+
+# BigQuery field type -> protobuf field type (FieldDescriptorProto.Type name) used for Storage
+#  Write API rows.  DATE is sent as days since the epoch, DATETIME as its canonical string and
+#  TIMESTAMP as epoch microseconds.  protobuf is only imported by the functions that build the
+#  rows, like google-cloud-bigquery-storage in BigQueryManager.write_df_to_bq_storage
+bq_to_proto_types = {
+    'DATE': 'TYPE_INT32',
+    'DATETIME': 'TYPE_STRING',
+    'TIMESTAMP': 'TYPE_INT64',
+    'INTEGER': 'TYPE_INT64',
+    'FLOAT': 'TYPE_DOUBLE',
+    'STRING': 'TYPE_STRING',
+}
+
 def get_bq_schemas():
     schema_historic_weather = [
         bigquery.SchemaField("weather_date", "DATE"),
@@ -34,6 +59,94 @@ def get_bq_schemas():
     #return schemas in dictionary
     return bq_schemas
 
+def get_arrow_schema(bq_schema):
+    """Returns a pyarrow schema with the same columns and types as bq_schema"""
+    return pa.schema([pa.field(field.name, bq_to_arrow_types[field.field_type]) for field in bq_schema])
+
+def coerce_df_to_schema(df, bq_schema):
+    """
+    Returns a copy of df with the columns in bq_schema cast to their BigQuery types
+    (DATE -> datetime.date, DATETIME -> datetime64[ns], INTEGER -> nullable Int64, FLOAT -> float64,
+    STRING -> str) and ordered as in the schema.  Columns not in the schema are kept at the end.
+    """
+    df = df.copy()
+    for field in bq_schema:
+        if field.name not in df.columns:
+            continue
+        column = df[field.name]
+        if field.field_type == 'DATE':
+            df[field.name] = pd.to_datetime(column).dt.date
+        elif field.field_type == 'DATETIME':
+            # parquet/arrow files read back as datetime64[us], keep every file on one unit
+            df[field.name] = pd.to_datetime(column).astype('datetime64[ns]')
+        elif field.field_type == 'TIMESTAMP':
+            df[field.name] = pd.to_datetime(column, utc=True)
+        elif field.field_type == 'INTEGER':
+            df[field.name] = pd.to_numeric(column).astype('Int64')
+        elif field.field_type == 'FLOAT':
+            df[field.name] = pd.to_numeric(column).astype('float64')
+        elif field.field_type == 'STRING':
+            df[field.name] = column.astype(str).where(column.notna(), None)
+
+    schema_columns = [field.name for field in bq_schema if field.name in df.columns]
+    other_columns = [column for column in df.columns if column not in schema_columns]
+    return df[schema_columns + other_columns]
+
+def get_proto_row_class(bq_schema, message_name='Row'):
+    """Returns a protobuf message class with one optional field per column of bq_schema"""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    file_proto = descriptor_pb2.FileDescriptorProto(name=f'{message_name.lower()}.proto', syntax='proto2')
+    message_proto = file_proto.message_type.add(name=message_name)
+    for field_number, field in enumerate(bq_schema, start=1):
+        message_proto.field.add(
+            name=field.name,
+            number=field_number,
+            type=descriptor_pb2.FieldDescriptorProto.Type.Value(bq_to_proto_types[field.field_type]),
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+        )
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    message_descriptor = pool.FindMessageTypeByName(message_name)
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(message_descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(message_descriptor)
+
+def df_to_proto_rows(df, bq_schema, row_class):
+    """Returns the rows of df serialized as row_class messages (see get_proto_row_class), nulls left unset"""
+    columns = {}
+    for field in bq_schema:
+        if field.name not in df.columns:
+            continue
+        column = df[field.name]
+        # Integer fields go through nullable Int64 and int(), a null would otherwise turn the
+        #  column to floats, which protobuf refuses for int32/int64 fields
+        if field.field_type == 'DATE':
+            values = (pd.to_datetime(column) - pd.Timestamp(0)).dt.days.astype('Int64')
+        elif field.field_type == 'DATETIME':
+            values = pd.to_datetime(column).dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        elif field.field_type == 'TIMESTAMP':
+            values = pd.to_datetime(column, utc=True).astype('int64') // 1000
+        elif field.field_type == 'INTEGER':
+            values = pd.to_numeric(column).astype('Int64')
+        elif field.field_type == 'FLOAT':
+            values = pd.to_numeric(column).astype('float64')
+        else:
+            values = column.astype(str)
+        values = values.astype(object).where(column.notna(), None).tolist()
+        if field.field_type in ('DATE', 'TIMESTAMP', 'INTEGER'):
+            values = [None if value is None else int(value) for value in values]
+        columns[field.name] = values
+
+    serialized_rows = []
+    for row_values in zip(*columns.values()):
+        row = row_class()
+        for column_name, value in zip(columns, row_values):
+            if value is not None:
+                setattr(row, column_name, value)
+        serialized_rows.append(row.SerializeToString())
+    return serialized_rows
+
 if __name__ == "__main__":
     bq_schemas = get_bq_schemas()
     print(bq_schemas['schema_historic_weather'])
@@ -43,4 +156,4 @@ if __name__ == "__main__":
     forecast_arrays = {field.name: [] for field in bq_forecast_schema}
     forecast_arrays['capture_date']
     print(forecast_field_names)
-    print(forecast_arrays)
\ No newline at end of file
+    print(forecast_arrays)
@@ -0,0 +1,140 @@
+import os
+import json
+import timeit
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from classes.ConfigManagerClass import ConfigManager
+from classes.OpenWeatherMap import WeatherForecastRetriever
+from classes.GCS import GCSManager
+from classes.StorageBackend import get_storage_backend
+
+# Micro-benchmarks for the pipeline hot paths, run from the repo root with:
+#   python -m utils.benchmarks
+# The union/write benchmarks run against the in-memory storage backend, no bucket needed
+
+sample_data_directory = os.path.join('data', 'sample data')
+sample_response_files = ['response_user1.json', 'response_user2.json']
+
+def load_sample_responses():
+    responses = []
+    for i, file_name in enumerate(sample_response_files):
+        with open(os.path.join(sample_data_directory, file_name), 'r') as file:
+            response = json.load(file)
+        response['user_name'] = f'user{i+1}'
+        responses.append(response)
+    return responses
+
+def transformJsonForecast_rowwise(json_user_forecast, forecast_field_names):
+    """
+    Reference copy of the original row by row transformJsonForecast, kept to benchmark and
+    check the vectorized version against
+    """
+    forecast_arrays = {field_name: [] for field_name in forecast_field_names}
+    json_user_forecast_list = json_user_forecast['list']
+    for i, singleuserssingleforecast in enumerate(json_user_forecast_list):
+        forecast_arrays['capture_date'].append(datetime.today().strftime('%Y-%m-%d'))
+        forecast_dateunix = json_user_forecast_list[i]['dt']
+        forecast_arrays['forecast_dateunix'].append(forecast_dateunix)
+        forecast_arrays['forecast_datetime'].append(pd.to_datetime(forecast_dateunix, unit='s'))
+        forecast_arrays['name'].append(json_user_forecast['user_name'])
+        if 'rain' in json_user_forecast_list[i]["weather"][0]['main'].lower():
+            forecast_arrays['rain_category'].append('rain')
+            forecast_arrays['rain_category_value'].append('1')
+        else:
+            forecast_arrays['rain_category'].append('no rain')
+            forecast_arrays['rain_category_value'].append('0')
+        main_weather = singleuserssingleforecast['main']
+        forecast_arrays['temp'].append(main_weather['temp'])
+        forecast_arrays['temp_min'].append(main_weather['temp_min'])
+        forecast_arrays['temp_max'].append(main_weather['temp_max'])
+        forecast_arrays['temp_humidity'].append(main_weather['humidity'])
+        forecast_arrays['weather_description'].append(singleuserssingleforecast['weather'][0]['description'])
+    return pd.DataFrame(forecast_arrays, columns=forecast_field_names)
+
+def benchmark_transformJsonForecast(number=200):
+    """
+    Times the rowwise and vectorized transforms over the sample responses and checks both
+    produce the same csv output.  Returns a dict of seconds per call for each.
+    """
+    owm = WeatherForecastRetriever()
+    owm.logger.disabled = True
+    responses = load_sample_responses()
+
+    for response in responses:
+        rowwise_csv = transformJsonForecast_rowwise(response, owm.forecast_field_names).to_csv(index=False)
+        vectorized_csv = owm.transformJsonForecast(response).to_csv(index=False)
+        if rowwise_csv != vectorized_csv:
+            raise AssertionError(f"Vectorized transform output differs from rowwise output for {response['user_name']}")
+
+    results = {
+        'rowwise': timeit.timeit(
+            lambda: [transformJsonForecast_rowwise(response, owm.forecast_field_names) for response in responses],
+            number=number) / (number * len(responses)),
+        'vectorized': timeit.timeit(
+            lambda: [owm.transformJsonForecast(response) for response in responses],
+            number=number) / (number * len(responses))
+    }
+    results['speedup'] = results['rowwise'] / results['vectorized']
+    return results
+
+def make_daily_forecast_df(capture_date, user_count):
+    """Synthetic day of forecasts shaped like the daily forecast files, 40 rows per user"""
+    rows_per_user = 40
+    row_count = user_count * rows_per_user
+    forecast_dateunix = int(datetime.strptime(capture_date, '%Y-%m-%d').timestamp()) + 10800 * np.tile(np.arange(rows_per_user), user_count)
+    rain = np.random.default_rng(row_count).random(row_count) < 0.3
+    return pd.DataFrame({
+        'capture_date': capture_date,
+        'forecast_dateunix': forecast_dateunix,
+        'forecast_datetime': pd.to_datetime(forecast_dateunix, unit='s'),
+        'name': np.repeat([f'user{i}' for i in range(user_count)], rows_per_user),
+        'rain_category': np.where(rain, 'rain', 'no rain'),
+        'rain_category_value': rain.astype(int),
+        'temp': 15.0, 'temp_min': 10.0, 'temp_max': 20.0, 'temp_humidity': 60,
+        'weather_description': np.where(rain, 'light rain', 'clear sky')
+    })
+
+def benchmark_union_and_write(day_count=365, user_count=20, backend_name='memory'):
+    """
+    Fills a local/in-memory bucket with day_count daily forecast files and times the union of
+    them and the write of the unioned file.  Returns a dict of seconds and the row count.
+    """
+    gcs_manager = GCSManager()
+    gcs_manager.storage = get_storage_backend(backend_name)
+    gcs_manager.logger.disabled = True
+    bucket_name, folder_path = 'benchmark-bucket', 'benchmark/daily_forecasts'
+    schema = gcs_manager.config.bq_schemas_historic_forecast
+
+    first_day = datetime(2024, 1, 1)
+    for day in range(day_count):
+        capture_date = (first_day + timedelta(days=day)).strftime('%Y-%m-%d')
+        gcs_manager.write_df_to_gcs(
+            make_daily_forecast_df(capture_date, user_count),
+            bucket_name=bucket_name,
+            gcs_bucket_filepath=f'{folder_path}/5-day forecast_{capture_date}.{gcs_manager.config.daily_file_format}',
+            schema=schema
+        )
+
+    start = timeit.default_timer()
+    unioned_df = gcs_manager.union_gcs_csv_blobs(
+        gcs_manager.iter_gcs_blobs(bucket_name, prefix=folder_path), folder_path, schema=schema
+    )
+    union_seconds = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    gcs_manager.write_df_to_gcs(unioned_df, bucket_name=bucket_name, gcs_bucket_filepath='benchmark/unioned_forecasts.csv', skip_unchanged=False)
+    write_seconds = timeit.default_timer() - start
+    return {'union': union_seconds, 'write': write_seconds, 'rows': len(unioned_df)}
+
+if __name__ == '__main__':
+    config = ConfigManager(yaml_filename='config.yaml', yaml_filepath='config')
+    results = benchmark_transformJsonForecast()
+    print(f"transformJsonForecast rowwise:    {results['rowwise']*1000:.3f} ms/call")
+    print(f"transformJsonForecast vectorized: {results['vectorized']*1000:.3f} ms/call")
+    print(f"speedup: {results['speedup']:.1f}x")
+
+    results = benchmark_union_and_write()
+    print(f"union of {results['rows']} rows:  {results['union']:.2f} s")
+    print(f"write of the unioned file: {results['write']:.2f} s")